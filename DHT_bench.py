@@ -0,0 +1,164 @@
+''' This DHT_bench.py file benchmarks a DHT network run in a single process. It is responsible for the following tasks:
+    1. Starting a manager (server) node and a host of peers on local ports, and setting up the DHT network with a year of storm events
+    2. Injecting delays into the find-event handling of some peers (slow peers, rare hiccups or a paused peer)
+    3. Reporting the latency percentiles of sequential queries with hedging turned off and on (the hedge benchmark)
+    4. Reporting how a skewed (zipf) load spreads over the peers with the hot key cache turned off and on (the hot benchmark)
+'''
+
+# Importing the necessary libraries
+import sys # for the real standard output, as the peers print every message they receive
+import os # for discarding the output of the peers
+import time # for measuring the latency of the queries
+import math # for turning hedging off with an infinite hedge delay
+import random # for sampling the queried event ids
+import contextlib # for discarding the output of the peers while they run
+import argparse # for the command line options of the benchmarks
+import itertools # for the cumulative weights of the zipf distribution
+
+from DHT_peer import DHT_peer, DHT_host, VIRTUAL_NODES, HOT_KEY_THRESHOLD
+from DHT_manager import DHT_manager
+from DHT_loadgen import percentile
+
+# The DHT_bench class (a manager, a host of peers set up as a DHT network and the clients querying it, all in this process)
+class DHT_bench:
+    # the constructor which starts the manager and the peers on the ports from base_port and sets up a DHT network of all the peers
+    def __init__(self, base_port, size, year, ip="127.0.0.1"):
+        self.ip = ip # the IPv4 address of the manager, the peers and the clients
+        self.base_port = base_port # the port of the manager, the peers use the next 2 * size ports
+        self.clients = 0 # the number of clients created, each uses the next two ports after the peers
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            self.manager = DHT_manager(ip, base_port, None, None)
+            self.manager.start()
+            self.host = DHT_host(ip, base_port, [("peer" + str(i), ip, base_port + 1 + 2 * i, base_port + 2 + 2 * i, VIRTUAL_NODES) for i in range(size)])
+            self.host.peers[0].setup_dht(size, year)
+        self.peers = self.host.peers # the peers in the DHT network
+        self.event_ids = [int(event[0]) for peer in self.peers for event in peer.local_hash_table.values()] # the event ids stored in the DHT network
+
+    # a method that creates a client (a peer registered with the manager but not in the DHT network) to send queries from
+    def client(self):
+        port = self.base_port + 1 + 2 * (len(self.peers) + self.clients)
+        self.clients += 1
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            return DHT_peer(self.ip, self.base_port, "client" + str(self.clients), self.ip, port, port + 1)
+
+    # a method that makes the find-event handling of the peers slower
+    # delays is a list of (peer_name, seconds, ratio) where peer_name may be "*" for all the peers and seconds may be math.inf for a paused peer
+    def inject_delays(self, delays):
+        for peer in self.peers:
+            peer.injected_delay, peer.injected_delay_ratio = 0, 1.0
+            for peer_name, seconds, ratio in delays:
+                if peer_name in ("*", peer.peer_name):
+                    peer.injected_delay, peer.injected_delay_ratio = seconds, ratio
+
+    # a method that sends the queries one after the other from a new client and returns their latencies and the number answered and hedged
+    # hedge is "off", "p<percentile>" for the adaptive hedge delay at that percentile, or "<milliseconds>ms" for a fixed hedge delay
+    def run_queries(self, event_ids, hedge):
+        client = self.client()
+        latencies = []
+        answered = 0
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            client.query_dht(event_ids[0]) # fetches the bloom filters and the ring view, as a client which has been querying would have them
+            time.sleep(0.2)
+            client.hedges = 0
+            for event_id in event_ids:
+                if hedge == "off":
+                    hedge_delay = math.inf
+                elif hedge.startswith("p"):
+                    hedge_delay = client.hedge_delay(percentile=float(hedge[1:]))
+                else:
+                    hedge_delay = float(hedge[:-2]) / 1000
+                start = time.perf_counter()
+                event = client.query_dht(event_id, hedge_delay=hedge_delay)
+                latencies.append(time.perf_counter() - start)
+                answered += event is not None
+        return sorted(latencies), answered, client.hedges
+
+    # a method that runs the same queries with each hedging mode and returns a report for each mode
+    def hedge(self, count, modes, delays, seed=None):
+        event_ids = random.Random(seed).sample(self.event_ids, min(count, len(self.event_ids)))
+        self.inject_delays(delays)
+        reports = []
+        for mode in modes:
+            latencies, answered, hedges = self.run_queries(event_ids, mode)
+            reports.append({
+                "hedge": mode,
+                "queries": len(event_ids),
+                "answered": answered,
+                "hedged": hedges,
+                "latency": {"p" + str(p): percentile(latencies, p) for p in (50, 90, 99)} | {"max": latencies[-1]},
+            })
+        return reports
+
+    # a method that sends the same zipf distributed queries with the hot key cache of the peers turned off and on and returns a report for each
+    # the k-th most popular event id is queried with a weight of 1 / k ** skew
+    def hot(self, count, skew, seed=None):
+        rng = random.Random(seed)
+        ranked = rng.sample(self.event_ids, len(self.event_ids)) # the event ids from the most to the least popular
+        weights = list(itertools.accumulate(1 / (k + 1) ** skew for k in range(len(ranked))))
+        event_ids = rng.choices(ranked, cum_weights=weights, k=count)
+        self.inject_delays([])
+        reports = []
+        for cache in ("off", "on"):
+            for peer in self.peers:
+                peer.hot_keys.clear()
+                peer.hot_keys.threshold = HOT_KEY_THRESHOLD if cache == "on" else math.inf
+                peer.hot_keys.hits = 0
+                peer.find_events = 0
+            start = time.perf_counter()
+            latencies, answered, _ = self.run_queries(event_ids, "off")
+            elapsed = time.perf_counter() - start
+            loads = [peer.find_events for peer in self.peers]
+            reports.append({
+                "cache": cache,
+                "queries": count,
+                "answered": answered,
+                "throughput": answered / elapsed,
+                "latency": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99)},
+                "find_events": sum(loads), # the find-event commands handled by all the peers
+                "imbalance": max(loads) / (sum(loads) / len(loads)), # the busiest peer compared to the average peer
+                "cache_hits": sum(peer.hot_keys.hits for peer in self.peers),
+            })
+        for peer in self.peers:
+            peer.hot_keys.threshold = HOT_KEY_THRESHOLD
+        return reports
+
+# a function that prints the reports of the hedge benchmark
+def print_hedge_reports(reports, delays):
+    print("Injected delays: " + (", ".join(peer_name + " " + str(seconds) + "s on " + str(ratio * 100) + "% of find-event" for peer_name, seconds, ratio in delays) or "none"))
+    for report in reports:
+        latencies = "  ".join(name + "=" + str(round(value * 1000, 1)) + "ms" for name, value in report["latency"].items())
+        print("hedge=" + report["hedge"].ljust(6) + " " + latencies + "  answered=" + str(report["answered"]) + "/" + str(report["queries"]) + "  hedged=" + str(report["hedged"]))
+
+# a function that prints the reports of the hot benchmark
+def print_hot_reports(reports, skew):
+    print("Zipf skew: " + str(skew))
+    for report in reports:
+        latencies = "  ".join(name + "=" + str(round(value * 1000, 1)) + "ms" for name, value in report["latency"].items())
+        print("cache=" + report["cache"].ljust(3) + " " + latencies + "  " + str(round(report["throughput"])) + " q/s  answered=" + str(report["answered"]) + "/" + str(report["queries"]) + "  find-event=" + str(report["find_events"]) + "  busiest/mean=" + str(round(report["imbalance"], 2)) + "  cache hits=" + str(report["cache_hits"]))
+
+# the main method
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark a DHT network run in this process.")
+    parser.add_argument("--base-port", type=int, default=43000, help="the port of the manager, the peers and the clients use the ports after it")
+    parser.add_argument("--peers", type=int, default=5, help="the number of peers in the DHT network")
+    parser.add_argument("--year", type=int, default=1996, help="the year of the storm events the DHT network is set up with")
+    parser.add_argument("--seed", type=int, default=1, help="the seed of the random choices, so that runs can be compared")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    hedge_parser = subparsers.add_parser("hedge", help="the latency percentiles of sequential queries with and without hedging")
+    hedge_parser.add_argument("--queries", type=int, default=1000, help="the number of queries for each hedging mode")
+    hedge_parser.add_argument("--hedge", nargs="+", default=["off", "p95"], help="the hedging modes: off, p<percentile> or <milliseconds>ms")
+    hedge_parser.add_argument("--delay", nargs=3, action="append", default=[], metavar=("PEER", "SECONDS", "RATIO"), help="delay this ratio of the find-event commands handled by a peer (PEER may be * for all the peers, SECONDS may be inf for a paused peer), can be repeated")
+    hot_parser = subparsers.add_parser("hot", help="how a skewed load spreads over the peers with and without the hot key cache")
+    hot_parser.add_argument("--queries", type=int, default=2000, help="the number of queries for each cache setting")
+    hot_parser.add_argument("--skew", type=float, default=1.1, help="the exponent of the zipf distribution of the queried event ids")
+    args = parser.parse_args()
+
+    random.seed(args.seed) # the injected delays are drawn from the random module
+    bench = DHT_bench(args.base_port, args.peers, args.year)
+    if args.benchmark == "hedge":
+        delays = [(peer_name, float(seconds), float(ratio)) for peer_name, seconds, ratio in args.delay]
+        print_hedge_reports(bench.hedge(args.queries, args.hedge, delays, args.seed), delays)
+    elif args.benchmark == "hot":
+        print_hot_reports(bench.hot(args.queries, args.skew, args.seed), args.skew)
+    sys.stdout.flush()
+    os._exit(0) # the peers and the manager listen on threads which do not stop
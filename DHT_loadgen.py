@@ -0,0 +1,231 @@
+''' This DHT_loadgen.py file generates query load against a running DHT network. It is responsible for the following tasks:
+    1. Sampling the event ids to query from the details-*.csv file the DHT network was set up with (uniform, zipf or replayed from a log) with a given ratio of misses
+    2. Sending find-event commands open-loop, at a target rate which does not depend on how fast the DHT network answers
+    3. Reporting the latency percentiles and the throughput, measured from the time each query was meant to be sent
+'''
+
+# Importing the necessary libraries
+import socket # for the socket the find-event commands are sent from and the responses are received on
+import threading # for receiving the responses while the queries are being sent
+import json # for encoding the peer sending the query and decoding the list of peers in the DHT network
+import random # for sampling the event ids and the peers the queries are sent to
+import time # for scheduling the queries and measuring their latency
+import bisect # for sampling the zipf distribution from its cumulative weights
+import itertools # for the cumulative weights of the zipf distribution
+import math # for the percentiles of the latencies
+import argparse # for the command line options of the load generator
+
+from DHT_peer import BUFFER_SIZE, ACK_RETRY_INTERVAL, ACK_TIMEOUT, read_csv_lines
+
+# the percentiles of the latency reported by the load generator
+PERCENTILES = (50, 90, 99, 99.9)
+
+# a function that reads the event ids from the csv files (the event id is the first column, and the header line is skipped)
+def read_event_ids(paths):
+    event_ids = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            size = file.seek(0, 2)
+        for line in read_csv_lines(path, 0, size):
+            event_id = line.split(b",", 1)[0].strip(b'"')
+            if event_id.isdigit():
+                event_ids.append(int(event_id))
+    return event_ids
+
+# a function that reads the event ids to replay from a log, in order
+# each line is either an event id on its own or a find-event command as printed by a peer when it receives it ("find-event <event_id> ...")
+def read_replay_log(path):
+    event_ids = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split()
+            if len(line) == 1 and line[0].isdigit():
+                event_ids.append(int(line[0]))
+            elif len(line) > 1 and line[0] == "find-event" and line[1].isdigit():
+                event_ids.append(int(line[1]))
+    return event_ids
+
+# a function that returns the given percentile of a sorted list of latencies (nearest rank), or None if the list is empty
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    return latencies[max(0, math.ceil(p / 100 * len(latencies)) - 1)]
+
+# The DHT_loadgen class (sends find-event commands to the peers in the DHT network at a target rate and measures the responses)
+class DHT_loadgen:
+    # the constructor which finds the peers in the DHT network through the given peer and opens the socket the responses are received on
+    # peer_in_DHT is the (IPv4_address, p_port) of any peer in the DHT network
+    # without event_ids, the event ids are read from the csv file the DHT network was populated from
+    def __init__(self, peer_in_DHT, event_ids=None, IPv4_address="127.0.0.1", port=0, timeout=1.0):
+        self.timeout = timeout # the number of seconds after which a query which has not been answered is counted as timed out
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((IPv4_address, port))
+        self.socket.settimeout(ACK_RETRY_INTERVAL)
+        self.address = self.socket.getsockname() # the address the peers in the DHT network send the responses to
+        ring = self.fetch_ring(peer_in_DHT)
+        self.peers_DHT = [tuple(peer) for peer in ring["peers"]] # the peers in the DHT network the queries are sent to
+        self.data_path = ring["data_path"] # the csv file the DHT network was populated from
+        self.event_ids = event_ids if event_ids is not None else read_event_ids([self.data_path]) # the event ids stored in the DHT network that the queries are sampled from
+        self.outstanding = {} # the queries which have not been answered yet, by tag: (intended send time, actual send time)
+        self.outstanding_lock = threading.Lock() # a lock to protect the outstanding queries as the responses are received on a separate thread
+        self.results = [] # the answered queries: (intended send time, actual send time, receive time, found)
+        self.sending = False # a flag to check if queries are still being sent, so the receiving thread knows when to stop
+
+    # a method that asks the given peer in the DHT network for its ring view (the list of peers in the DHT network and the csv file it was populated from), retransmitting like a broadcast does
+    def fetch_ring(self, peer_in_DHT):
+        start = time.monotonic()
+        while time.monotonic() - start < ACK_TIMEOUT:
+            self.socket.sendto("get-ring ring".encode('utf-8'), peer_in_DHT)
+            try:
+                response, _ = self.socket.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            # the response is of the form "ack ring <peer_name> <json of the ring view>"
+            response = response.decode('utf-8').split(" ", 3)
+            if response[:2] == ["ack", "ring"]:
+                return json.loads(response[3])
+        raise TimeoutError("The peer " + str(peer_in_DHT) + " did not send the list of peers in the DHT network.")
+
+    # a method that samples the event ids to query
+    # distribution is "uniform", "zipf" (the event ids are ranked in a random order and the k-th is queried with weight 1/k^zipf_exponent) or "replay" (replay_ids in order, repeated if needed)
+    # a miss_ratio of the queries ask for event ids which are not stored in the DHT network
+    def sample_event_ids(self, count, distribution="uniform", zipf_exponent=1.1, miss_ratio=0.0, replay_ids=None, seed=None):
+        generator = random.Random(seed)
+        if distribution == "uniform":
+            event_ids = [generator.choice(self.event_ids) for _ in range(count)]
+        elif distribution == "zipf":
+            ranked = list(self.event_ids)
+            generator.shuffle(ranked)
+            weights = list(itertools.accumulate(1 / (k + 1) ** zipf_exponent for k in range(len(ranked))))
+            event_ids = [ranked[bisect.bisect_left(weights, generator.random() * weights[-1])] for _ in range(count)]
+        elif distribution == "replay":
+            if not replay_ids:
+                raise ValueError("The replay log has no event ids.")
+            event_ids = [replay_ids[i % len(replay_ids)] for i in range(count)]
+        else:
+            raise ValueError("Unknown distribution " + distribution + ".")
+
+        # the missing event ids are taken above the largest stored event id so that none of them is stored in the DHT network
+        largest = max(self.event_ids)
+        return [largest + generator.randint(1, largest) if generator.random() < miss_ratio else event_id for event_id in event_ids]
+
+    # a method that sends the find-event commands for the event ids open-loop at the given rate (queries per second) and returns the report
+    # poisson spaces the queries with exponential gaps of the same mean instead of evenly
+    def run(self, event_ids, rate, poisson=True, seed=None):
+        generator = random.Random(seed)
+        self.outstanding = {}
+        self.results = []
+        self.sending = True
+        receive_thread = threading.Thread(target=self.receive_responses)
+        receive_thread.start()
+
+        # the time each query is meant to be sent at is fixed in advance, so a slow response never delays the next query (open-loop)
+        start = time.perf_counter()
+        intended = start
+        max_lag = 0 # the largest delay between the time a query was meant to be sent and the time it was sent
+        for tag, event_id in enumerate(event_ids):
+            intended += generator.expovariate(rate) if poisson else 1 / rate
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # the peer sending the query is the load generator, with the tag of the query as a 4th element so that the response can be matched to it
+            peer_sending_query = json.dumps(("loadgen", self.address[0], self.address[1], tag), separators=(",", ":"))
+            find_event_command = "find-event " + str(event_id) + " " + peer_sending_query + " id-seq"
+            peer = generator.choice(self.peers_DHT)
+            sent = time.perf_counter()
+            with self.outstanding_lock:
+                self.outstanding[tag] = (intended, sent)
+            self.socket.sendto(find_event_command.encode('utf-8'), (peer[1], int(peer[2])))
+            max_lag = max(max_lag, sent - intended)
+
+        # wait for the responses to the last queries, up to the timeout
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            with self.outstanding_lock:
+                if not self.outstanding:
+                    break
+            time.sleep(0.001)
+        self.sending = False
+        receive_thread.join()
+        return self.report(len(event_ids), rate, start, intended, max_lag)
+
+    # the method that receives the responses to the find-event commands while the queries are being sent
+    def receive_responses(self):
+        while self.sending:
+            try:
+                response, _ = self.socket.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            received = time.perf_counter()
+            # the response is either of the form "FAILURE <tag>" or "SUCCESS <tag>\n<event record> <id_seq>"
+            return_code = response.decode('utf-8').split("\n", 1)[0].split(" ")
+            if len(return_code) != 2 or not return_code[1].isdigit():
+                continue # not a response to a tagged query
+            with self.outstanding_lock:
+                query = self.outstanding.pop(int(return_code[1]), None)
+            if query is None:
+                continue # a duplicate or a response to a query which already timed out
+            intended, sent = query
+            if received - intended > self.timeout:
+                continue # the response came too late (counting from the time the query was meant to be sent, like its corrected latency), so the query is counted as timed out
+            self.results.append((intended, sent, received, return_code[0] == "SUCCESS"))
+
+    # a method that summarises the queries
+    # the corrected latency is measured from the time each query was meant to be sent, so the queries delayed by a stalled sender are not left out (coordinated omission)
+    # the queries which timed out count with an infinite latency in the percentiles, so that dropping the slowest queries cannot make the percentiles look better
+    def report(self, count, rate, start, end, max_lag):
+        answered = len(self.results)
+        timed_out = [math.inf] * (count - answered)
+        corrected = sorted([received - intended for intended, sent, received, found in self.results] + timed_out)
+        uncorrected = sorted([received - sent for intended, sent, received, found in self.results] + timed_out)
+        # the throughput counts the answered queries over the span of the schedule, up to the last response
+        last = max([received for intended, sent, received, found in self.results] + [end])
+        report = {
+            "offered_rate": rate, # the target rate of queries per second
+            "sent": count, # the number of queries sent
+            "answered": answered, # the number of queries answered before timing out
+            "found": sum(1 for result in self.results if result[3]), # the number of queries whose record was found
+            "not_found": sum(1 for result in self.results if not result[3]), # the number of queries answered with FAILURE (or a different record)
+            "timed_out": count - answered, # the number of queries not answered within the timeout
+            "throughput": answered / (last - start) if last > start else 0, # the answered queries per second of the schedule
+            "max_sender_lag": max_lag, # the largest delay in seconds between the time a query was meant to be sent and the time it was sent
+            "latency": {str(p): percentile(corrected, p) for p in PERCENTILES} | {"max": corrected[-1] if corrected else None}, # corrected latencies in seconds (infinite for a percentile which falls on a timed out query)
+            "service_latency": {str(p): percentile(uncorrected, p) for p in PERCENTILES} | {"max": uncorrected[-1] if uncorrected else None}, # latencies in seconds from the time each query was actually sent (infinite as above)
+        }
+        return report
+
+    # a method that prints a report returned by run
+    def print_report(self, report):
+        def milliseconds(latencies):
+            return "  ".join(name + "=" + ("-" if value is None else "timed out" if value == math.inf else str(round(value * 1000, 2)) + "ms") for name, value in latencies.items())
+        print("Offered " + str(report["offered_rate"]) + " queries per second: " + str(report["sent"]) + " sent, " + str(report["answered"]) + " answered (" + str(report["found"]) + " found, " + str(report["not_found"]) + " not found), " + str(report["timed_out"]) + " timed out.")
+        print("Throughput: " + str(round(report["throughput"], 1)) + " answered queries per second (largest sender lag " + str(round(report["max_sender_lag"] * 1000, 2)) + "ms).")
+        print("Latency from the intended send time (corrected): " + milliseconds(report["latency"]))
+        print("Latency from the actual send time (uncorrected): " + milliseconds(report["service_latency"]))
+
+# the main method
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send find-event queries open-loop to a running DHT network and report the latencies.")
+    parser.add_argument("--peer", nargs=2, metavar=("ADDRESS", "P_PORT"), required=True, help="the address and p-port of any peer in the DHT network")
+    parser.add_argument("--data", nargs="+", help="the csv files the event ids are sampled from (by default the file the DHT network was populated from)")
+    parser.add_argument("--distribution", choices=("uniform", "zipf", "replay"), default="uniform", help="how the event ids are sampled")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1, help="the exponent of the zipf distribution")
+    parser.add_argument("--replay", metavar="LOG", help="a log of event ids or find-event commands to replay in order (with --distribution replay)")
+    parser.add_argument("--miss-ratio", type=float, default=0.0, help="the fraction of the queries for event ids which are not stored")
+    parser.add_argument("--rate", type=float, default=100, help="the target rate of queries per second")
+    parser.add_argument("--duration", type=float, default=10, help="the number of seconds to send queries for")
+    parser.add_argument("--constant", action="store_true", help="send the queries evenly spaced instead of with poisson arrivals")
+    parser.add_argument("--timeout", type=float, default=1.0, help="the number of seconds after which a query is counted as timed out")
+    parser.add_argument("--ip", default="127.0.0.1", help="the IPv4 address the responses are received on")
+    parser.add_argument("--seed", type=int, help="the seed of the random samples")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    loadgen = DHT_loadgen((args.peer[0], int(args.peer[1])), read_event_ids(args.data) if args.data else None, args.ip, timeout=args.timeout)
+    replay_ids = read_replay_log(args.replay) if args.replay is not None else None
+    event_ids = loadgen.sample_event_ids(int(args.rate * args.duration), args.distribution, args.zipf_exponent, args.miss_ratio, replay_ids, args.seed)
+    report = loadgen.run(event_ids, args.rate, not args.constant, args.seed)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        loadgen.print_report(report)
@@ -12,11 +12,22 @@
 import socket # for creating and managing the sockets
 import threading # for creating and handling the threads (for parallel client-server communication)
 import random # for random selection of free peers during setup-dht
+import json # for encoding the journal records and the snapshots of the manager state
+import os # for fsync and for atomically replacing the snapshot file
+import multiprocessing # for the worker processes sharing the manager port
+import argparse # for the command line options of the manager
+
+# the size of the buffer used for receiving datagrams (large enough for the register-batch command of a host running a few thousand peers)
+BUFFER_SIZE = 65507
+# the number of journal records after which the manager state is written to a snapshot and the journal is emptied
+SNAPSHOT_EVERY = 100000
 
 # The DHT manager class
 class DHT_manager:
     #The constructor which initializes the required variables
-    def __init__(self, manager_address, manager_port):
+    # journal_path and snapshot_path are the files the manager state is persisted to (pass None for journal_path to keep the state in memory only)
+    # workers is the number of processes receiving on the manager port (the extra worker processes answer query-dht from a replica of the state)
+    def __init__(self, manager_address, manager_port, journal_path="DHT_manager.journal", snapshot_path="DHT_manager.snapshot", workers=1):
         self.manager_address = manager_address # setting the IP address of the DHT manager
         self.port = manager_port # setting the port number for the DHT manager to 42000
         self.peers_dict = {} # dictionary to store the peers and their respective ports
@@ -28,10 +39,157 @@ class DHT_manager:
         self.leaving_peer_name = "" # string to store the name of the peer that is leaving the DHT in order to wait for the dht-rebuilt command
         self.joining_peer_name = "" # string to store the name of the peer that is joining the DHT in order to wait for the dht-rebuilt command
 
+        # the write-ahead journal of the changes to the state above, replayed on startup on top of the last snapshot
+        self.journal_path = journal_path # the path of the append-only journal file
+        self.snapshot_path = snapshot_path # the path of the compacted snapshot file
+        self.journal_lock = threading.Lock() # a lock so that the changes to the state are applied and journaled in the same order
+        self.journal_written = threading.Condition(self.journal_lock) # notified whenever journal records have been fsynced
+        self.journal_buffer = [] # the journal records which have not been written to the journal file yet
+        self.journal_seq = 0 # the sequence number of the last journal record
+        self.durable_seq = 0 # the sequence number of the last journal record which has been fsynced
+        self.journal_records = 0 # the number of records in the journal file since the last snapshot
+        self.workers = workers # the number of processes receiving on the manager port
+        self.worker_connections = [] # the pipes to the worker processes, which every journal record is sent through
+        if self.journal_path is not None:
+            self.recover()
+            self.journal_file = open(self.journal_path, 'a')
+            # the thread which writes and fsyncs the journal records in batches
+            journal_thread = threading.Thread(target=self.write_journal, daemon=True)
+            journal_thread.start()
+
+    # the method that restores the manager state from the snapshot and the journal (if they exist)
+    def recover(self):
+        if self.snapshot_path is not None and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as file:
+                self.load_state(json.load(file))
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb+') as file:
+                end = 0 # the end of the last complete record in the journal
+                for line in file:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        record = json.loads(line)
+                    except ValueError:
+                        break # a record torn by a crash while it was being written, which was never acknowledged
+                    end += len(line)
+                    if record[0] > self.journal_seq: # skip the records which are already part of the snapshot
+                        self.apply_record(record)
+                        self.journal_seq = record[0]
+                        self.journal_records += 1
+                # cut off the torn record so that the new records are not appended to it
+                file.truncate(end)
+        self.durable_seq = self.journal_seq
+        if self.peers_dict or self.dht_exists:
+            print("Recovered " + str(len(self.peers_dict)) + " registered peers from the journal")
+
+    # the method that returns the whole manager state, as written to the snapshot file and sent to the worker processes
+    def state(self):
+        return {
+            "seq": self.journal_seq,
+            "peers_dict": self.peers_dict,
+            "flags": {name: getattr(self, name) for name in ("dht_exists", "dht_in_progress", "dht_teardown_in_progress", "dht_rebuilding_in_progress", "leaving_peer_name", "joining_peer_name")},
+        }
+
+    # the method that replaces the manager state with the given state
+    def load_state(self, state):
+        self.peers_dict = state["peers_dict"]
+        for name, value in state["flags"].items():
+            setattr(self, name, value)
+        self.journal_seq = state["seq"]
+
+    # the method that applies a journal record of the form [<seq>, <op>, <args>...] to the manager state
+    def apply_record(self, record):
+        op = record[1]
+        if op == "register": # [seq, "register", peer_name, [peer_ipv4, m_port, p_port, state]]
+            self.peers_dict[record[2]] = record[3]
+        elif op == "state": # [seq, "state", peer_name, state]
+            self.peers_dict[record[2]][3] = record[3]
+        elif op == "deregister": # [seq, "deregister", peer_name]
+            self.peers_dict.pop(record[2], None)
+        elif op == "flags": # [seq, "flags", {flag: value}]
+            for name, value in record[2].items():
+                setattr(self, name, value)
+
+    # the method that applies a change to the manager state and appends it to the journal (must be called with journal_lock held)
+    def journal(self, *change):
+        self.journal_seq += 1
+        record = [self.journal_seq, *change]
+        self.apply_record(record)
+        # the worker processes apply the record to their replica of the state before they handle their next command
+        for connection in self.worker_connections:
+            connection.send(record)
+        if self.journal_path is not None:
+            self.journal_buffer.append(record)
+            self.journal_written.notify_all() # wake up the journal thread
+
+    # the methods that change the manager state through the journal
+    def register_peer(self, peer_name, value):
+        with self.journal_lock:
+            self.journal("register", peer_name, value)
+
+    def set_peer_state(self, peer_name, state):
+        with self.journal_lock:
+            self.journal("state", peer_name, state)
+
+    def deregister_peer(self, peer_name):
+        with self.journal_lock:
+            self.journal("deregister", peer_name)
+
+    def set_flags(self, **flags):
+        with self.journal_lock:
+            self.journal("flags", flags)
+
+    # the method that waits until all the changes made so far are durable, called before replying SUCCESS to a peer
+    def sync_journal(self):
+        if self.journal_path is None:
+            return
+        with self.journal_lock:
+            seq = self.journal_seq
+            while self.durable_seq < seq:
+                self.journal_written.wait()
+
+    # the method run by the journal thread which writes the buffered records and fsyncs them once for the whole batch
+    def write_journal(self):
+        while True:
+            with self.journal_lock:
+                while not self.journal_buffer:
+                    self.journal_written.wait()
+                # take every record added while the last batch was being fsynced, so a busy manager fsyncs once for many changes
+                records, self.journal_buffer = self.journal_buffer, []
+            self.journal_file.write("".join(json.dumps(record) + "\n" for record in records))
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            with self.journal_lock:
+                self.durable_seq = records[-1][0]
+                self.journal_records += len(records)
+                if self.journal_records >= SNAPSHOT_EVERY and self.snapshot_path is not None:
+                    self.write_snapshot()
+                self.journal_written.notify_all()
+
+    # the method that writes the whole manager state to the snapshot file and empties the journal (must be called with journal_lock held)
+    def write_snapshot(self):
+        # the records journaled while the last batch was being fsynced are part of the snapshot, so they need not be written to the journal
+        self.journal_buffer = []
+        with open(self.snapshot_path + ".tmp", 'w') as file:
+            json.dump(self.state(), file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path) # the snapshot replaces the old one atomically
+        # the journal can now be emptied, as every record in it is part of the snapshot
+        self.journal_file.truncate(0)
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.durable_seq = self.journal_seq
+        self.journal_records = 0
+
     # the start method to start the DHT manager and listen for incoming connections
     def start(self):
         # creating a socket for the DHT manager
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.workers > 1:
+            # let the worker processes bind to the same port, the kernel then spreads the peers across the sockets by their address
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # binding the socket to an IP address and port number
         server_socket.bind((self.manager_address, self.port))
 
@@ -43,72 +201,141 @@ class DHT_manager:
         # creating a thread to listen for incoming connections
         server_thread = threading.Thread(target=self.listen, args=(server_socket,))
         server_thread.start() # starting the thread
+
+        # start the worker processes, each with a copy of the current state and a pipe to the manager
+        context = multiprocessing.get_context("spawn")
+        for i in range(self.workers - 1):
+            connection, worker_connection = context.Pipe()
+            with self.journal_lock: # so that no change is made between copying the state and adding the pipe the following changes are sent through
+                state = self.state()
+                self.worker_connections.append(connection)
+            worker = context.Process(target=run_worker, args=(self.manager_address, self.port, state, worker_connection), daemon=True)
+            worker.start()
+            # the thread which handles the commands forwarded by the worker process
+            forward_thread = threading.Thread(target=self.receive_forwarded, args=(server_socket, connection), daemon=True)
+            forward_thread.start()
+
+    # the method that handles the commands which a worker process received and forwarded to the manager
+    # the replies are sent from the manager socket, which is bound to the same port as the worker sockets
+    def receive_forwarded(self, server_socket, connection):
+        while True:
+            peer_data, peer_address = connection.recv()
+            self.dispatch(server_socket, peer_data, peer_address)
+
+    # the method run by a worker process which receives on the manager port alongside the manager
+    # query-dht only reads the state, so the worker answers it from its replica, and every other command is forwarded to the manager
+    # the replica is brought up to date before each command, so a peer always sees the changes it was told SUCCESS for
+    def listen_worker(self, connection):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((self.manager_address, self.port))
+
+        # the thread which keeps applying the journal records from the manager while the worker is idle
+        replica_thread = threading.Thread(target=self.receive_records, args=(connection,), daemon=True)
+        replica_thread.start()
+
+        while True:
+            # receive any data that is incoming from peers
+            peer_data, peer_address = server_socket.recvfrom(BUFFER_SIZE)
+            # decode the data to a string
+            peer_data = peer_data.decode('utf-8')
+            # print the data received
+            print(peer_data)
+            # split the data on the basis of spaces and store it in a list
+            peer_data = peer_data.split(' ')
+            with self.journal_lock:
+                self.apply_records(connection)
+                if peer_data[0] == "query-dht" and not (self.dht_in_progress or self.dht_teardown_in_progress or self.dht_rebuilding_in_progress):
+                    self.query_dht(server_socket, peer_address, *peer_data[1:])
+                    continue
+            connection.send((peer_data, peer_address))
+
+    # the method run by the replica thread of a worker process
+    def receive_records(self, connection):
+        try:
+            while True:
+                connection.poll(None)
+                with self.journal_lock:
+                    self.apply_records(connection)
+        except EOFError:
+            os._exit(0) # the manager has exited, so the worker must not keep the port
+
+    # the method that applies all the journal records the manager has sent to a worker process so far (must be called with journal_lock held)
+    def apply_records(self, connection):
+        while connection.poll():
+            self.apply_record(connection.recv())
     
     # the listen method that listens for incoming connection requests
     def listen(self, server_socket):
         # The DHT manager's server thread will keep running and listening for incoming connections
         while True:
             # receive any data that is incoming from peers
-            peer_data, peer_address = server_socket.recvfrom(1024)
+            peer_data, peer_address = server_socket.recvfrom(BUFFER_SIZE)
             # decode the data to a string
             peer_data = peer_data.decode('utf-8')
             # print the data received
             print(peer_data)
             # split the data on the basis of spaces and store it in a list
             peer_data = peer_data.split(' ')
-            if peer_data[0] == "dht-complete": # if the command is dht-complete
-                # start a thread to handle the dht-complete command as the DHT manager can handle multiple peers at the same time
-                dht_complete_thread = threading.Thread(target=self.dht_complete, args=(server_socket, peer_address, *peer_data[1:]))
-                dht_complete_thread.start()
-            elif peer_data[0] == "dht-rebuilt": # if the command is dht-rebuilt
-                # start a thread to handle the dht-rebuilt command as the DHT manager can handle multiple peers at the same time
-                dht_rebuilt_thread = threading.Thread(target=self.dht_rebuilt, args=(server_socket, peer_address, *peer_data[1:]))
-                dht_rebuilt_thread.start()
-            elif peer_data[0] == "teardown-complete": # if the command is teardown-complete
-                # start a thread to handle the teardown-complete command as the DHT manager can handle multiple peers at the same time
-                teardown_complete_thread = threading.Thread(target=self.teardown_complete, args=(server_socket, peer_address, *peer_data[1:]))
-                teardown_complete_thread.start()
-            # first check if the dht_in_progress or dht_teardown_in_progress or dht_rebuilding_in_progress boolean is True and if it is, wait for the dht-complete or teardown-complete command by sending "FAILURE: DHT in progress" or "FAILURE: Teardown in progress" or "FAILURE: Rebuilding in progress" to the peer and its respective m-port
-            elif self.dht_in_progress or self.dht_teardown_in_progress or self.dht_rebuilding_in_progress:
-                if self.dht_in_progress:
-                    server_socket.sendto("FAILURE: DHT in progress".encode('utf-8'), (peer_address, int(peer_data[1])))
-                elif self.dht_teardown_in_progress:
-                    server_socket.sendto("FAILURE: Teardown in progress".encode('utf-8'), (peer_address, int(peer_data[1])))
-                else:
-                    server_socket.sendto("FAILURE: Rebuilding in progress".encode('utf-8'), (peer_address, int(peer_data[1])))
-                continue
-            # check the command received and call the respective method
-            elif peer_data[0] == "register": # if the command is register
-                # start a thread to handle the register command as the DHT manager can handle multiple peers at the same time
-                register_thread = threading.Thread(target=self.register, args=(server_socket, peer_address, *peer_data[1:]))
-                register_thread.start()
-            elif peer_data[0] == "setup-dht": # if the command is setup-dht
-                # start a thread to handle the setup-dht command as the DHT manager can handle multiple peers at the same time
-                setup_dht_thread = threading.Thread(target=self.setup_dht, args=(server_socket, peer_address, *peer_data[1:]))
-                setup_dht_thread.start()
-            elif peer_data[0] == "query-dht": # if the command is query-dht
-                # start a thread to handle the query-dht command as the DHT manager can handle multiple peers at the same time
-                query_dht_thread = threading.Thread(target=self.query_dht, args=(server_socket, peer_address, *peer_data[1:]))
-                query_dht_thread.start()
-            elif peer_data[0] == "leave-dht": # if the command is leave-dht
-                # start a thread to handle the leave-dht command as the DHT manager can handle multiple peers at the same time
-                leave_dht_thread = threading.Thread(target=self.leave_dht, args=(server_socket, peer_address, *peer_data[1:]))
-                leave_dht_thread.start()
-            elif peer_data[0] == "join-dht": # if the command is join-dht
-                # start a thread to handle the join-dht command as the DHT manager can handle multiple peers at the same time
-                join_dht_thread = threading.Thread(target=self.join_dht, args=(server_socket, peer_address, *peer_data[1:]))
-                join_dht_thread.start()
-            elif peer_data[0] == "deregister": # if the command is deregister
-                # start a thread to handle the deregister command as the DHT manager can handle multiple peers at the same time
-                deregister_thread = threading.Thread(target=self.deregister, args=(server_socket, peer_address, *peer_data[1:]))
-                deregister_thread.start()
-            elif peer_data[0] == "teardown-dht": # if the command is teardown-dht
-                # start a thread to handle the teardown-dht command as the DHT manager can handle multiple peers at the same time
-                teardown_dht_thread = threading.Thread(target=self.teardown_dht, args=(server_socket, peer_address, *peer_data[1:]))
-                teardown_dht_thread.start()
-            
-            else: # if the command is not recognized
-                print("Command not recognized")
+            self.dispatch(server_socket, peer_data, peer_address)
+
+    # the method that calls the handler of a command received from a peer (directly or forwarded by a worker process)
+    def dispatch(self, server_socket, peer_data, peer_address):
+        if peer_data[0] == "dht-complete": # if the command is dht-complete
+            # start a thread to handle the dht-complete command as the DHT manager can handle multiple peers at the same time
+            dht_complete_thread = threading.Thread(target=self.dht_complete, args=(server_socket, peer_address, *peer_data[1:]))
+            dht_complete_thread.start()
+        elif peer_data[0] == "dht-rebuilt": # if the command is dht-rebuilt
+            # start a thread to handle the dht-rebuilt command as the DHT manager can handle multiple peers at the same time
+            dht_rebuilt_thread = threading.Thread(target=self.dht_rebuilt, args=(server_socket, peer_address, *peer_data[1:]))
+            dht_rebuilt_thread.start()
+        elif peer_data[0] == "teardown-complete": # if the command is teardown-complete
+            # start a thread to handle the teardown-complete command as the DHT manager can handle multiple peers at the same time
+            teardown_complete_thread = threading.Thread(target=self.teardown_complete, args=(server_socket, peer_address, *peer_data[1:]))
+            teardown_complete_thread.start()
+        # first check if the dht_in_progress or dht_teardown_in_progress or dht_rebuilding_in_progress boolean is True and if it is, wait for the dht-complete or teardown-complete command by sending "FAILURE: DHT in progress" or "FAILURE: Teardown in progress" or "FAILURE: Rebuilding in progress" to the peer and its respective m-port
+        elif self.dht_in_progress or self.dht_teardown_in_progress or self.dht_rebuilding_in_progress:
+            if self.dht_in_progress:
+                server_socket.sendto("FAILURE: DHT in progress".encode('utf-8'), (peer_address, int(peer_data[1])))
+            elif self.dht_teardown_in_progress:
+                server_socket.sendto("FAILURE: Teardown in progress".encode('utf-8'), (peer_address, int(peer_data[1])))
+            else:
+                server_socket.sendto("FAILURE: Rebuilding in progress".encode('utf-8'), (peer_address, int(peer_data[1])))
+        # check the command received and call the respective method
+        elif peer_data[0] == "register": # if the command is register
+            # start a thread to handle the register command as the DHT manager can handle multiple peers at the same time
+            register_thread = threading.Thread(target=self.register, args=(server_socket, peer_address, *peer_data[1:]))
+            register_thread.start()
+        elif peer_data[0] == "register-batch": # if the command is register-batch (a host registering all the peers it runs at once)
+            register_batch_thread = threading.Thread(target=self.register_batch, args=(server_socket, peer_address, *peer_data[1:]))
+            register_batch_thread.start()
+        elif peer_data[0] == "setup-dht": # if the command is setup-dht
+            # start a thread to handle the setup-dht command as the DHT manager can handle multiple peers at the same time
+            setup_dht_thread = threading.Thread(target=self.setup_dht, args=(server_socket, peer_address, *peer_data[1:]))
+            setup_dht_thread.start()
+        elif peer_data[0] == "query-dht": # if the command is query-dht
+            # start a thread to handle the query-dht command as the DHT manager can handle multiple peers at the same time
+            query_dht_thread = threading.Thread(target=self.query_dht, args=(server_socket, peer_address, *peer_data[1:]))
+            query_dht_thread.start()
+        elif peer_data[0] == "leave-dht": # if the command is leave-dht
+            # start a thread to handle the leave-dht command as the DHT manager can handle multiple peers at the same time
+            leave_dht_thread = threading.Thread(target=self.leave_dht, args=(server_socket, peer_address, *peer_data[1:]))
+            leave_dht_thread.start()
+        elif peer_data[0] == "join-dht": # if the command is join-dht
+            # start a thread to handle the join-dht command as the DHT manager can handle multiple peers at the same time
+            join_dht_thread = threading.Thread(target=self.join_dht, args=(server_socket, peer_address, *peer_data[1:]))
+            join_dht_thread.start()
+        elif peer_data[0] == "deregister": # if the command is deregister
+            # start a thread to handle the deregister command as the DHT manager can handle multiple peers at the same time
+            deregister_thread = threading.Thread(target=self.deregister, args=(server_socket, peer_address, *peer_data[1:]))
+            deregister_thread.start()
+        elif peer_data[0] == "teardown-dht": # if the command is teardown-dht
+            # start a thread to handle the teardown-dht command as the DHT manager can handle multiple peers at the same time
+            teardown_dht_thread = threading.Thread(target=self.teardown_dht, args=(server_socket, peer_address, *peer_data[1:]))
+            teardown_dht_thread.start()
+        
+        else: # if the command is not recognized
+            print("Command not recognized")
             
     def register(self, server_socket, peer_address, *args):
         # divide the arguments into peer name, IPv4 address, m-port, and p-port
@@ -116,34 +343,56 @@ class DHT_manager:
         peer_ipv4 = args[1]
         m_port = int(args[2])
         p_port = int(args[3])
+
+        # register the peer and send the failure message to the peer if it could not be registered
+        returncode = self.add_peer(peer_name, peer_ipv4, m_port, p_port)
+        if returncode != "SUCCESS":
+            server_socket.sendto(returncode.encode('utf-8'), peer_address)
+            # exit the method
+            return
+
+        # send a success message to the peer once the registration is durable
+        self.sync_journal()
+        server_socket.sendto("SUCCESS".encode('utf-8'), peer_address)
+
+    # the method that registers all the peers run by a host with a single command
+    # the arguments are groups of peer name, IPv4 address, m-port, and p-port, one group for each peer
+    def register_batch(self, server_socket, peer_address, *args):
+        returncodes = []
+        for i in range(0, len(args) - 3, 4):
+            peer_name = args[i]
+            peer_ipv4 = args[i + 1]
+            m_port = int(args[i + 2])
+            p_port = int(args[i + 3])
+            returncodes.append(peer_name + " " + self.add_peer(peer_name, peer_ipv4, m_port, p_port))
+
+        # send the return code of every peer (one line for each peer of the form "<peer_name> SUCCESS" or "<peer_name> FAILURE: <reason>") once the registrations are durable
+        self.sync_journal()
+        server_socket.sendto("\n".join(returncodes).encode('utf-8'), peer_address)
+
+    # the method that checks a peer can be registered and adds it to the peers dictionary
+    # returns "SUCCESS" or the failure message to send to the peer
+    def add_peer(self, peer_name, peer_ipv4, m_port, p_port):
         # check the length of peer_name (should be at most 15 characters)
         if len(peer_name) > 15:
             # checks if the length of the peer name is greater than 15 characters
-            server_socket.sendto("FAILURE: Peer name should be at most 15 characters".encode('utf-8'), peer_address)
-            # exit the method
-            return
+            return "FAILURE: Peer name should be at most 15 characters"
         
         # check if the peer name is already registered in the peers dictionary
         if peer_name in self.peers_dict:
             # checks if the peer name is already registered
-            server_socket.sendto("FAILURE: Peer name is already registered".encode('utf-8'), peer_address)
-            # exit the method
-            return
+            return "FAILURE: Peer name is already registered"
         
         # check if the m-port and p-port are already registered in the peers dictionary
         # peer_dict stores values in the form { <peer_name>: [<peer_ipv4>, <m_port>, <p_port>, <state_of_peer>] }
-        for key, value in self.peers_dict.items():
+        for key, value in list(self.peers_dict.items()): # copied as other peers may register at the same time
             if value[1] == m_port or value[2] == p_port:
                 # checks if the m-port or p-port is already registered
-                server_socket.sendto("FAILURE: m-port or p-port is already registered".encode('utf-8'), peer_address)
-                # exit the method
-                return
+                return "FAILURE: m-port or p-port is already registered"
         
         # if the peer name, m-port, and p-port are not already registered, add the peer to the peers dictionary
-        self.peers_dict[peer_name] = [peer_ipv4, m_port, p_port, "Free"]
-
-        # send a success message to the peer
-        server_socket.sendto("SUCCESS".encode('utf-8'), peer_address)
+        self.register_peer(peer_name, [peer_ipv4, m_port, p_port, "Free"])
+        return "SUCCESS"
     
     def setup_dht(self, server_socket, peer_address, *args):
         # divide the arguments into peer name, size n, and data from year YYYY
@@ -180,7 +429,7 @@ class DHT_manager:
             return
         
         # If all the checks pass, set the state of the peer to "Leader"
-        self.peers_dict[peer_name][3] = "Leader"
+        self.set_peer_state(peer_name, "Leader")
 
         # Get a list of all the "Free" peers from the peers dictionary
         free_peers = [key for key, value in self.peers_dict.items() if value[3] == "Free"]
@@ -190,7 +439,7 @@ class DHT_manager:
 
         # Update the state of the randomly selected free_peers to "InDHT"
         for peer in free_peers:
-            self.peers_dict[peer][3] = "InDHT"
+            self.set_peer_state(peer, "InDHT")
         
         # create a list containing 3-tuple elements of the form (peer_name, peer_ipv4, p_port)
         # the first element of the list is the leader's 3-tuple
@@ -201,11 +450,12 @@ class DHT_manager:
         
 
         # set the DHT in progress boolean to True
-        self.dht_in_progress = True
+        self.set_flags(dht_in_progress=True)
 
         # send a return code of SUCCESS and the dht_list to the leader
         print("working here")
         returncode = "SUCCESS\n" + str(dht_list)
+        self.sync_journal()
         server_socket.sendto(returncode.encode('utf-8'), peer_address)
     
     def dht_complete(self, server_socket, peer_address, *args):
@@ -220,11 +470,11 @@ class DHT_manager:
             return
         
         # set the DHT exists boolean to True as the DHT is now complete
-        self.dht_exists = True
         # set the DHT in progress boolean to False as the DHT is now complete so the manager can now listen for incoming commands
-        self.dht_in_progress = False
+        self.set_flags(dht_exists=True, dht_in_progress=False)
 
         # send a return code of SUCCESS to the leader
+        self.sync_journal()
         server_socket.sendto("SUCCESS".encode('utf-8'), peer_address)
 
     def query_dht(self, server_socket, peer_address, *args):
@@ -278,12 +528,11 @@ class DHT_manager:
             return
         
         # store the name of the leaving peer in the leaving_peer_name variable
-        self.leaving_peer_name = peer_name
-
         # set the dht_rebuilding_in_progress boolean to True
-        self.dht_rebuilding_in_progress = True
+        self.set_flags(leaving_peer_name=peer_name, dht_rebuilding_in_progress=True)
 
         # send a return code of SUCCESS to the peer
+        self.sync_journal()
         server_socket.sendto("SUCCESS: Left the DHT".encode('utf-8'), peer_address)
 
     def join_dht(self, server_socket, peer_address, *args):
@@ -305,12 +554,11 @@ class DHT_manager:
             return
         
         # store the name of the joining peer in the joining_peer_name variable
-        self.joining_peer_name = peer_name
-
         # set the dht_rebuilding_in_progress boolean to True
-        self.dht_rebuilding_in_progress = True
+        self.set_flags(joining_peer_name=peer_name, dht_rebuilding_in_progress=True)
 
         # send a return code of SUCCESS along with the 3-tuple of the leader to the peer
+        self.sync_journal()
         returncode = "SUCCESS\n" + str((self.peers_dict[peer_name], self.peers_dict[peer_name][0], self.peers_dict[peer_name][2]))
         server_socket.sendto(returncode.encode('utf-8'), peer_address)
 
@@ -328,27 +576,28 @@ class DHT_manager:
         
         # if the peer_name is the leaving_peer_name, set the state of the peer to "Free"
         if peer_name == self.leaving_peer_name:
-            self.peers_dict[peer_name][3] = "Free"
-            self.leaving_peer_name = ""
+            self.set_peer_state(peer_name, "Free")
+            self.set_flags(leaving_peer_name="")
         
         # if the peer_name is the joining_peer_name, set the state of the peer to "InDHT"
         if peer_name == self.joining_peer_name:
-            self.peers_dict[peer_name][3] = "InDHT"
-            self.joining_peer_name = ""
+            self.set_peer_state(peer_name, "InDHT")
+            self.set_flags(joining_peer_name="")
 
         # check if the new_leader is the same as the leader of the DHT
         # if not, set the state of the new_leader to "Leader" and the state of the old leader to "InDHT
         if self.peers_dict[new_leader][3] != "Leader":
             for key, value in self.peers_dict.items(): # find the old leader and set its state to "InDHT"
                 if value[3] == "Leader":
-                    self.peers_dict[key][3] = "InDHT"
+                    self.set_peer_state(key, "InDHT")
                     break
-            self.peers_dict[new_leader][3] = "Leader" # set the state of the new_leader to "Leader"
-        
+            self.set_peer_state(new_leader, "Leader") # set the state of the new_leader to "Leader"
+
         # set the dht_rebuilding_in_progress boolean to False
-        self.dht_rebuilding_in_progress = False
+        self.set_flags(dht_rebuilding_in_progress=False)
 
         # send a return code of SUCCESS to the peer
+        self.sync_journal()
         server_socket.sendto("SUCCESS: DHT rebuilt".encode('utf-8'), peer_address)
 
     def deregister(self, server_socket, peer_address, *args):
@@ -363,9 +612,10 @@ class DHT_manager:
             return
         
         # remove the peer from the peers dictionary (deregister the peer)
-        self.peers_dict.pop(peer_name)
+        self.deregister_peer(peer_name)
 
         # send a return code of SUCCESS to the peer
+        self.sync_journal()
         server_socket.sendto("SUCCESS: Deregistered".encode('utf-8'), peer_address)
 
     def teardown_dht(self, server_socket, peer_address, *args):
@@ -380,9 +630,10 @@ class DHT_manager:
             return
         
         # set the DHT teardown in progress boolean to True
-        self.dht_teardown_in_progress = True
+        self.set_flags(dht_teardown_in_progress=True)
 
         # send a return code of SUCCESS to the leader
+        self.sync_journal()
         server_socket.sendto("SUCCESS: Teardown in progress".encode('utf-8'), peer_address)
 
     def teardown_complete(self, server_socket, peer_address, *args):
@@ -397,26 +648,38 @@ class DHT_manager:
             return
         
         # change the state of all the peers in the DHT to "Free"
-        for key, value in self.peers_dict.items():
+        for key, value in list(self.peers_dict.items()):
             if value[3] == "InDHT" or value[3] == "Leader":
-                self.peers_dict[key][3] = "Free"
+                self.set_peer_state(key, "Free")
 
         # set the DHT exists boolean to False as the DHT has been torn down
-        self.dht_exists = False
-
         # set the DHT teardown in progress boolean to False as the DHT has been torn down so the manager can now listen for incoming commands
-        self.dht_teardown_in_progress = False
+        self.set_flags(dht_exists=False, dht_teardown_in_progress=False)
 
         # send a return code of SUCCESS to the leader
+        self.sync_journal()
         server_socket.sendto("SUCCESS: Teardown complete".encode('utf-8'), peer_address)
 
+# the function run in a worker process of the manager with a copy of the manager state and a pipe to the manager
+def run_worker(manager_address, manager_port, state, connection):
+    worker = DHT_manager(manager_address, manager_port, journal_path=None)
+    worker.load_state(state)
+    worker.listen_worker(connection)
 
 # the main method to create the DHT manager and start it
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the DHT manager.")
+    parser.add_argument("--workers", type=int, default=1, help="the number of processes receiving on the manager port")
+    journal_group = parser.add_mutually_exclusive_group()
+    journal_group.add_argument("--journal", metavar="PATH", default="DHT_manager.journal", help="the journal the manager state is persisted to (the snapshot is written next to it, with the .snapshot extension)")
+    journal_group.add_argument("--no-journal", action="store_true", help="keep the manager state in memory only, so it is lost when the manager stops")
+    args = parser.parse_args()
+    journal_path = None if args.no_journal else args.journal
+    snapshot_path = None if args.no_journal else os.path.splitext(args.journal)[0] + ".snapshot"
     # ask the user for the IP address of the DHT manager and the port number
     manager_address = input("Enter the IP address of the DHT manager: ")
     manager_port = int(input("Enter the port number of the DHT manager (42000-42499): "))
     # create the DHT manager
-    dht_manager = DHT_manager(manager_address, manager_port)
+    dht_manager = DHT_manager(manager_address, manager_port, journal_path, snapshot_path, workers=args.workers)
     # start the DHT manager
     dht_manager.start()
\ No newline at end of file
@@ -10,11 +10,423 @@ import csv # for reading and writing csv files
 import math # for mathematical operations
 import json # for encoding and decoding json data
 import random # for generating random numbers
+import time # for timing out and retransmitting broadcasts to the peers in the DHT network
+import sys # for measuring the memory used by the local hash table
+import hashlib # for hashing the event ids into the bloom filter
+import base64 # for encoding the bits of the bloom filter as text
+import os # for finding the size of the csv file and the number of cores
+import multiprocessing # for parsing and hashing the csv file in a pool of processes
+import collections # for the queue of csv chunks being parsed
+import bisect # for searching the sorted index of event ids
+import heapq # for merging the sorted records returned by the peers for a range query
+import selectors # for listening on the p-ports of all the peers run by a host with a single thread
+import argparse # for the command line options of the host mode
+import array # for the counters of the count-min sketch of hot event ids
+import zlib # for compressing large batches of records sent between the peers
+
+# the size of the buffer used for receiving datagrams (large enough for the ring view of a few hundred peers)
+BUFFER_SIZE = 65507
+# the number of seconds to wait for acknowledgements before retransmitting a broadcast to the peers that have not replied
+ACK_RETRY_INTERVAL = 0.5
+# the number of seconds after which a broadcast is abandoned if some peers have still not acknowledged it
+ACK_TIMEOUT = 10
+# the default false positive rate of the bloom filter over the event ids stored by a peer
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+# the number of event ids the bloom filter is sized for initially (it is rebuilt with twice the capacity whenever it fills up)
+BLOOM_INITIAL_CAPACITY = 1024
+# the number of seconds after which a querying peer fetches the bloom filters of the DHT network again
+BLOOM_REFRESH_INTERVAL = 30
+# the number of bytes of the bloom filter bits sent in each reply to get-bloom (base64 encoded, so a part fits in one datagram)
+BLOOM_PART_BYTES = 45000
+# the number of seconds a querying peer waits for the bloom filters before going on without the filters of the peers which did not reply
+BLOOM_FETCH_TIMEOUT = 1
+# the size of the kernel receive buffer of the p-port socket, so that bursts of store batches are not dropped
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+# the number of bytes of the csv file parsed by a process at a time when populating the DHT
+INGEST_CHUNK_BYTES = 1024 * 1024
+# the number of processes used to parse the csv file (files which fit in a single chunk are parsed without a pool)
+INGEST_WORKERS = os.cpu_count() or 1
+# the maximum size of the json encoded records sent in a single store-batch command or in a single page of a range query
+STORE_BATCH_BYTES = 60000
+# the number of bytes of buffered writes for one peer at which the write buffer of a client is flushed
+WRITE_BUFFER_BYTES = STORE_BATCH_BYTES
+# the number of seconds a write may wait in the write buffer of a client before it is flushed
+WRITE_BUFFER_DELAY = 0.05
+# the number of seconds for which a client keeps using the list of peers in the DHT network it last fetched
+RING_REFRESH_INTERVAL = 30
+# the number of counters in each row of the count-min sketch a peer uses to find the event ids it forwards most often
+HOT_KEY_SKETCH_WIDTH = 2048
+# the number of rows of the count-min sketch (each event id is counted once in every row)
+HOT_KEY_SKETCH_DEPTH = 4
+# the number of lookups of an event id in an epoch after which a forwarding peer caches its record
+HOT_KEY_THRESHOLD = 8
+# the maximum number of records a peer keeps in its hot key cache
+HOT_KEY_CACHE_SIZE = 256
+# the number of seconds in an epoch, after which the cached records are dropped and the counts in the sketch are halved
+HOT_KEY_EPOCH = 5
+# the default number of virtual positions a peer owns in the hash table (a peer with twice the capacity should be given twice as many)
+VIRTUAL_NODES = 16
+# the size of the commands in bytes from which batches of records are compressed (smaller commands are sent as they are)
+COMPRESSION_THRESHOLD = 1024
+# the maximum size of the shared compression dictionary (zlib only looks back this far)
+COMPRESSION_DICTIONARY_BYTES = 32768
+# the zlib compression level used for the batches of records
+COMPRESSION_LEVEL = 6
+# the number of seconds a query waits for the response to a find-event command before giving up
+QUERY_DEADLINE = 2
+# the percentile of the latencies of the recent find-event commands after which a hedged duplicate is sent (it is sent by half the deadline at the latest)
+HEDGE_PERCENTILE = 95
+# the number of seconds after which a hedged duplicate is sent until enough latencies have been measured
+HEDGE_INITIAL_DELAY = 0.05
+# the number of latencies of recent find-event commands the hedge delay is computed from (it is only computed once there are HEDGE_MIN_SAMPLES of them)
+QUERY_LATENCY_WINDOW = 512
+HEDGE_MIN_SAMPLES = 20
+
+# a function that splits the csv file into byte ranges of about chunk_bytes which start and end on a line boundary
+# the rows of the csv file must not contain line breaks inside quoted fields (true for the storm event details files)
+def split_csv(path, chunk_bytes):
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        header = file.readline()
+        # the details files use either \n, \r\n or a bare \r as the line terminator
+        terminator = b'\r' if b'\r' in header and not header.endswith(b'\n') else b'\n'
+        if terminator == b'\r':
+            file.seek(header.index(b'\r') + 1)
+        start = file.tell()
+        while start < file_size:
+            end = min(start + chunk_bytes, file_size)
+            if end < file_size:
+                # move the end of the chunk forward to the next line terminator
+                file.seek(end)
+                rest = b''
+                while terminator not in rest:
+                    block = file.read(4096)
+                    if not block:
+                        break
+                    rest += block
+                end = end + rest.index(terminator) + 1 if terminator in rest else file_size
+            yield (start, end)
+            start = end
+
+# a function that reads the lines of the csv file in the given byte range
+def read_csv_lines(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return [line for line in file.read(end - start).splitlines() if line.strip()]
+
+# a function that reads the rows of the csv file in the given byte range
+def read_csv_range(path, start, end):
+    return list(csv.reader(line.decode('utf-8') for line in read_csv_lines(path, start, end)))
+
+# a function that counts the rows of the csv file in the given byte range without parsing them (run in the pool of processes)
+def count_csv_range(path, start, end):
+    return len(read_csv_lines(path, start, end))
+
+# a function that builds the shared compression dictionary from a sample of the rows of the csv file
+# the dictionary holds the column values (json encoded as in a record) that would save the most bytes, with the best ones last as zlib finds those most cheaply
+def train_dictionary(rows, size=COMPRESSION_DICTIONARY_BYTES):
+    counts = collections.Counter(json.dumps(value) + ", " for row in rows for value in row)
+    values = []
+    total = 0
+    for value, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break # a value seen once in the sample is not worth the space
+        value = value.encode('utf-8')
+        if total + len(value) <= size:
+            values.append(value)
+            total += len(value)
+    return b"".join(reversed(values))
+
+# a function that compresses an encoded command with zlib and the shared dictionary
+# the compressed command is of the form "zlib <dictionary_id> <compressed bytes>" and is None if compressing does not make it smaller
+def compress_command(data, dictionary, dictionary_id):
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=dictionary)
+    compressed = b"zlib " + dictionary_id.encode('ascii') + b" " + compressor.compress(data) + compressor.flush()
+    return compressed if len(compressed) < len(data) else None
+
+# a function that lays out the virtual positions of the peers, given the number of virtual nodes of each peer in the order of their ids
+# the positions of each peer are spread evenly over the list, and the list is the same on every peer given the same numbers
+# returns the list of the id owning each virtual position
+def assign_virtual_nodes(virtual_nodes):
+    positions = sorted(((k + 0.5) / count, id) for id, count in enumerate(virtual_nodes) for k in range(count))
+    return [id for _, id in positions]
+
+# a function that returns the identifier of the peer in the DHT network storing the records at position pos of the hash table
+# slots is the list returned by assign_virtual_nodes, or None before the leader has sent it, in which case every peer owns one position
+def owner_of(pos, slots, ring_size):
+    if slots is None:
+        return pos % ring_size
+    return slots[pos % len(slots)]
+
+# a function that parses and hashes the rows of the csv file in the given byte range (run in the pool of processes)
+# returns the batches of records for each peer in the form { <id>: [<json list of [pos, event] pairs of at most STORE_BATCH_BYTES>] }
+def shard_csv_range(path, start, end, s, slots, ring_size):
+    batches = {}
+    pending = {} # the [pos, event] pairs not yet put in a batch for each peer, with an estimate of their encoded size
+    for event in read_csv_range(path, start, end):
+        pos = int(event[0]) % s # the position of the event in the local hash table
+        id = owner_of(pos, slots, ring_size) # the identifier of the peer in the DHT network that is responsible for storing the event
+        size = sum(map(len, event)) + 4 * len(event) + 16 # the size of the pair once json encoded (quotes and separators around each field)
+        records = pending.setdefault(id, [[], 0])
+        if records[1] + size > STORE_BATCH_BYTES:
+            batches.setdefault(id, []).extend(encode_batch(records[0]))
+            records[0], records[1] = [], 0
+        records[0].append([pos, event])
+        records[1] += size
+    for id, records in pending.items():
+        if records[0]:
+            batches.setdefault(id, []).extend(encode_batch(records[0]))
+    return batches
+
+# a function that json encodes a list of [pos, event] pairs in one go, splitting it in half if the estimate of its size was too low
+def encode_batch(records):
+    payload = json.dumps(records)
+    if len(payload) <= STORE_BATCH_BYTES or len(records) == 1:
+        return [payload]
+    return encode_batch(records[:len(records) // 2]) + encode_batch(records[len(records) // 2:])
+
+# The BloomFilter class (a compact set of event ids which can answer "definitely not stored" without a lookup)
+class BloomFilter:
+    # the constructor which sizes the filter for the given capacity and false positive rate
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = capacity # the number of event ids the filter is sized for
+        self.false_positive_rate = false_positive_rate # the false positive rate once the filter holds capacity event ids
+        self.size = max(8, int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))) # the number of bits in the filter
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2)))) # the number of bits set for each event id
+        self.count = 0 # the number of event ids added to the filter
+        self.bits = bytearray((self.size + 7) // 8)
+
+    # a method that computes the positions of the bits for an event id (double hashing of one digest)
+    def positions(self, event_id):
+        digest = hashlib.blake2b(str(event_id).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    # a method that adds an event id to the filter
+    def add(self, event_id):
+        for position in self.positions(event_id):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    # a method that returns False if the event id is definitely not in the filter and True if it might be
+    def might_contain(self, event_id):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(event_id))
+
+    # a method that returns the number of parts of BLOOM_PART_BYTES the bits of the filter are sent in
+    def parts(self):
+        return max(1, (len(self.bits) + BLOOM_PART_BYTES - 1) // BLOOM_PART_BYTES)
+
+    # a method that encodes one part of the filter as a json string so it can be sent to other peers in a single datagram
+    def to_json(self, part=0):
+        return json.dumps({
+            "capacity": self.capacity,
+            "false_positive_rate": self.false_positive_rate,
+            "count": self.count,
+            "parts": self.parts(),
+            "part": part,
+            "bits": base64.b64encode(bytes(self.bits[part * BLOOM_PART_BYTES:(part + 1) * BLOOM_PART_BYTES])).decode('ascii'),
+        })
+
+    # a method that decodes a filter from the list of all its parts encoded by to_json
+    # returns None if a part is missing or the parts come from different filters (the filter was rebuilt while it was being fetched)
+    @staticmethod
+    def from_json(parts):
+        parts = [json.loads(part) for part in parts]
+        first = parts[0]
+        if [part["part"] for part in parts] != list(range(first["parts"])):
+            return None
+        if any(part["capacity"] != first["capacity"] or part["parts"] != first["parts"] for part in parts):
+            return None
+        bloom_filter = BloomFilter(first["capacity"], first["false_positive_rate"])
+        bloom_filter.count = max(part["count"] for part in parts)
+        bits = bytearray(b"".join(base64.b64decode(part["bits"]) for part in parts))
+        if len(bits) != len(bloom_filter.bits):
+            return None
+        bloom_filter.bits = bits
+        return bloom_filter
+
+# The HotKeyCache class (counts the event ids a peer sees in find-event commands and caches the records of the hottest ones)
+# the counts are kept in a count-min sketch so the memory used does not grow with the number of distinct event ids
+# the cache is emptied at the start of every epoch, so a cached record is never more than one epoch older than the record of its owner
+class HotKeyCache:
+    # the constructor which creates an empty sketch and cache
+    def __init__(self, width=HOT_KEY_SKETCH_WIDTH, depth=HOT_KEY_SKETCH_DEPTH, threshold=HOT_KEY_THRESHOLD, capacity=HOT_KEY_CACHE_SIZE, epoch_length=HOT_KEY_EPOCH):
+        self.width = width # the number of counters in each row of the sketch
+        self.depth = depth # the number of rows of the sketch
+        self.threshold = threshold # the number of lookups in an epoch after which an event id is hot
+        self.capacity = capacity # the maximum number of cached records
+        self.epoch_length = epoch_length # the number of seconds in an epoch
+        self.counts = array.array('I', bytes(4 * width * depth)) # the counters of the sketch, one row after the other
+        self.records = collections.OrderedDict() # the cached records in least recently used order, in the form { <event_id>: <event> }
+        self.filling = set() # the hot event ids whose records have been asked for in this epoch
+        self.epoch = 0 # the number of the current epoch
+        self.epoch_started = time.monotonic() # the time at which the current epoch started
+        self.hits = 0 # the number of lookups answered from the cache
+        self.lock = threading.Lock() # a lock to protect the sketch and the cache as the find-event commands are handled on separate threads
+
+    # a method that computes the position of the counter for an event id in every row of the sketch
+    def positions(self, event_id):
+        digest = hashlib.blake2b(str(event_id).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    # a method that starts a new epoch if the current one is over (must be called with the lock held)
+    def roll_epoch(self):
+        now = time.monotonic()
+        if now - self.epoch_started < self.epoch_length:
+            return
+        self.epoch += 1
+        self.epoch_started = now
+        self.records.clear()
+        self.filling.clear()
+        # halve the counts so that event ids which stop being looked up cool down
+        for i in range(len(self.counts)):
+            self.counts[i] >>= 1
+
+    # a method that counts a lookup of an event id and returns the cached record (or None)
+    # also returns True if the event id is hot but not cached, in which case the caller should fetch its record
+    def lookup(self, event_id):
+        with self.lock:
+            self.roll_epoch()
+            positions = self.positions(event_id)
+            for position in positions:
+                self.counts[position] += 1
+            event = self.records.get(event_id)
+            if event is not None:
+                self.records.move_to_end(event_id)
+                self.hits += 1
+                return event, False
+            hot = min(self.counts[position] for position in positions) >= self.threshold
+            if hot and event_id not in self.filling:
+                self.filling.add(event_id)
+                return None, True
+            return None, False
+
+    # a method that caches the record of a hot event id, dropping the least recently used record if the cache is full
+    def put(self, event_id, event):
+        with self.lock:
+            self.roll_epoch()
+            if event_id not in self.filling:
+                return # the record was asked for in an earlier epoch
+            self.records[event_id] = event
+            self.records.move_to_end(event_id)
+            if len(self.records) > self.capacity:
+                self.records.popitem(last=False)
+
+    # a method that drops all the cached records (when the peer leaves the DHT network or the ring changes)
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.filling.clear()
+
+# The WriteBuffer class (coalesces the put, update and delete writes of a client for each peer storing them and sends them as write-batch commands)
+class WriteBuffer:
+    # the constructor which starts the thread that flushes the buffer when writes have waited for max_delay
+    def __init__(self, peer, max_bytes=WRITE_BUFFER_BYTES, max_delay=WRITE_BUFFER_DELAY):
+        self.peer = peer # the DHT_peer which sends the write-batch commands
+        self.max_bytes = max_bytes # the number of buffered bytes for one peer at which the buffer is flushed
+        self.max_delay = max_delay # the number of seconds a write may wait before the buffer is flushed
+        self.pending = {} # the buffered writes in the form { <peer_name>: { <event_id>: [<op>, <event_id>, <event or None>] } }
+        self.pending_bytes = {} # the size of the buffered writes for each peer
+        self.targets = {} # the 3-tuple (peer_name, peer_ipv4, p_port) of each peer with buffered writes
+        self.oldest = None # the time at which the oldest buffered write was added
+        self.lock = threading.Lock() # a lock to protect the buffered writes
+        self.flush_lock = threading.Lock() # a lock so that only one flush is in progress at a time
+        self.results = {"applied": 0, "missing": 0, "collision": 0, "forwarded": 0} # the totals reported by the peers for the flushed writes
+        self.unacknowledged = 0 # the number of writes put back in the buffer by the last flush because their peer did not acknowledge them
+        self.flush_thread = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flush_thread.start()
+
+    # a method that buffers a write (op is "put", "update" or "delete") for the peer storing the event id
+    def add(self, op, event_id, event=None):
+        ring = self.peer.get_ring_view()
+        if ring is None or ring["table_size"] is None:
+            print("FAILURE: the DHT has not been populated")
+            return False
+        owner = ring["peers"][owner_of(event_id % ring["table_size"], ring["slots"], len(ring["peers"]))]
+
+        with self.lock:
+            full = self.buffer(owner, op, event_id, event)
+
+        if full:
+            self.flush()
+        return True
+
+    # a method that buffers a write for the given peer and returns True if the buffer for that peer is full (called with the lock held)
+    def buffer(self, owner, op, event_id, event):
+        writes = self.pending.setdefault(owner[0], {})
+        previous = writes.get(event_id)
+        # coalesce the writes to the same event id: the latest write wins, but an update of a buffered put is still a put
+        if op == "update" and previous is not None and previous[0] == "put":
+            op = "put"
+        write = [op, event_id, event]
+        size = len(json.dumps(write)) + 2
+        if previous is not None:
+            self.pending_bytes[owner[0]] -= len(json.dumps(previous)) + 2
+        writes[event_id] = write
+        self.pending_bytes[owner[0]] = self.pending_bytes.get(owner[0], 0) + size
+        self.targets[owner[0]] = owner
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        return self.pending_bytes[owner[0]] >= self.max_bytes
+
+    # a method that sends all the buffered writes to the peers storing them in parallel and waits until all of them have acknowledged them
+    # returns True if every peer acknowledged its writes, and False if some did not, in which case their writes are put back in the buffer
+    # (under any write to the same event id buffered since) to be sent again by the next flush
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, targets = self.pending, self.targets
+                self.pending, self.pending_bytes, self.targets, self.oldest = {}, {}, {}, None
+            if not pending:
+                return True
+
+            commands = {peer_name: "write-batch " + json.dumps(list(writes.values())) for peer_name, writes in pending.items()}
+            acks = self.peer.broadcast("write", lambda peer: commands[peer[0]], targets=list(targets.values()), partial=True)
+            missing = [peer_name for peer_name in pending if peer_name not in acks]
+            if missing:
+                with self.lock:
+                    newer, newer_targets = self.pending, self.targets
+                    self.pending, self.pending_bytes, self.targets, self.oldest = {}, {}, {}, None
+                    for peer_name in missing:
+                        for op, event_id, event in pending[peer_name].values():
+                            self.buffer(targets[peer_name], op, event_id, event)
+                    for peer_name, writes in newer.items():
+                        for op, event_id, event in writes.values():
+                            self.buffer(newer_targets[peer_name], op, event_id, event)
+                self.unacknowledged = sum(len(pending[peer_name]) for peer_name in missing)
+                print("FAILURE: " + str(self.unacknowledged) + " writes were not acknowledged and will be sent again")
+            else:
+                self.unacknowledged = 0
+            written = []
+            for peer_name, payload in acks.items():
+                results = json.loads(payload)
+                for key, count in results.items():
+                    self.results[key] += count
+                # the puts and updates are now stored, so the bloom filters this peer fetched must know them to not report them as definite misses
+                # a write passed on to another peer (the ring has changed) may be stored by any peer, so it is added to all the filters
+                owner = None if results["forwarded"] else peer_name
+                written += [(owner, event_id) for op, event_id, _ in pending[peer_name].values() if op != "delete"]
+            self.peer.add_written_event_ids(written)
+            return not missing
+
+    # the method that flushes the buffer whenever the oldest buffered write has waited for max_delay
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.max_delay / 2)
+            with self.lock:
+                due = self.oldest is not None and time.monotonic() - self.oldest >= self.max_delay
+            if due:
+                self.flush()
 
 # The DHT_peer class
 class DHT_peer:
     # the constructor which initializes the required variables
-    def __init__(self, manager_addres, manager_port, peer_name, peer_IPv4_address, m_port, p_port):
+    # virtual_nodes is the number of positions of the hash table the peer owns, relative to the other peers (give a bigger machine more)
+    # standalone is False when the peer is run by a DHT_host, which registers it with the manager and listens on its p-port instead
+    def __init__(self, manager_addres, manager_port, peer_name, peer_IPv4_address, m_port, p_port, bloom_false_positive_rate=BLOOM_FALSE_POSITIVE_RATE, standalone=True, virtual_nodes=VIRTUAL_NODES):
         self.manager_addres = manager_addres # the address of the manager (server) node
         self.manager_port = manager_port # the port of the manager (server) node
         self.peer_name = peer_name # the name of the peer
@@ -25,17 +437,58 @@ class DHT_peer:
         self.m_port_socket.bind((self.peer_IPv4_address, self.m_port)) # binding the socket to the localhost and port 42001
         self.p_port_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # for communication with the peer nodes
         self.p_port_socket.bind((self.peer_IPv4_address, self.p_port)) # binding the socket to the localhost and port 42002
+        self.p_port_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE) # room for bursts of store batches
         self.id = None # the identifier of the peer in the DHT network
         self.ring_size = None # the size of the ring in the DHT network
         self.peers_DHT = None # the list of peers in the DHT network
+        self.configured_ring = None # the (id, ring_size, json of the list of peers) set by the last set_id command, so that a resent set_id does not clear the records again
         self.right_neighbour = None # the right neighbour of the peer in the DHT network
         self.local_hash_table = {} # the local hash table of the peer
-        self.printed = False # a flag to check if the configuration of the local hash table has been printed
-        self.can_populate = False # a flag to check if the peer can populate the local hash table
+        self.bloom_false_positive_rate = bloom_false_positive_rate # the target false positive rate of the bloom filter of the peer
+        self.bloom_filter = BloomFilter(BLOOM_INITIAL_CAPACITY, self.bloom_false_positive_rate) # the bloom filter over the event ids stored in the local hash table
+        self.bloom_lock = threading.Lock() # a lock to protect the bloom filter as the store commands are handled on separate threads
+        self.data_version = time.time_ns() # the version of the records of the peer, increased whenever records are stored or dropped (starts from the clock so a restarted peer does not reuse a version)
+        self.bloom_subscribers = {} # the addresses of the peers which fetched the bloom filter of this peer and the time they fetched it, in the form { (<ipv4>, <p_port>): <time> }
+        self.bloom_filters = {} # the bloom filters of the peers in the DHT network as last fetched by this peer when querying, in the form { <peer_name>: (<BloomFilter>, <time fetched>, <data version>) }
+        self.bloom_versions = {} # the latest data version announced by each peer in the DHT network with a bloom-version command, in the form { <peer_name>: <data version> }
+        self.bloom_peers = None # the names of the peers in the DHT network when the bloom filters were last fetched
+        self.bloom_filters_fetched_at = 0 # the time at which the bloom filters were last fetched
+        self.bloom_refresh_thread = None # the thread fetching the bloom filters in the background for the queries, None if no fetch is in progress
+        self.bloom_filters_lock = threading.Lock() # a lock so that the event ids written by this peer are not lost when the bloom filters are replaced
+        self.written_event_ids = None # the (peer_name or None for any peer, event_id) pairs put or updated by this peer while the bloom filters are being fetched, None when no fetch is in progress
+        self.event_index = [] # the index of the event ids stored in the local hash table, a list of (event_id, pos) pairs sorted by event id
+        self.event_index_sorted = True # a flag to check if records have been appended to the event index since it was last sorted
+        self.event_index_lock = threading.Lock() # a lock to protect the event index as the store commands are handled on separate threads
+        self.table_size = None # the size s of the hash table the records are placed in (pos = event_id % s), set by the leader when populating
+        self.data_path = 'details-1996.csv' # the csv file of storm events the DHT network is populated from, set from the year when setting up
+        self.virtual_nodes = virtual_nodes # the number of virtual positions this peer owns
+        self.ring_virtual_nodes = None # the number of virtual positions of each peer in the DHT network in the order of their ids, set by the leader when populating
+        self.slots = None # the id of the peer owning each virtual position (computed from ring_virtual_nodes by assign_virtual_nodes)
+        self.dictionary = None # the shared compression dictionary sent by the leader when populating
+        self.dictionary_id = None # the identifier of the shared compression dictionary (a hash of its contents)
+        self.compress_batches = False # a flag set on the leader when every peer has accepted the dictionary, so the store batches are compressed
+        self.ring_view = None # the list of peers in the DHT network and the table size as last fetched by this peer as a client
+        self.ring_view_fetched_at = 0 # the time at which the ring view was last fetched
+        self.write_buffer = None # the buffer of the put, update and delete writes sent by this peer as a client (created on the first write)
+        self.hot_keys = HotKeyCache() # the counts of the event ids this peer forwards and the cached records of the hottest ones
+        self.acks = {} # the acknowledgements received for each broadcast in progress, in the form { <ack_type>: { <peer_name>: <payload> } }
+        self.broadcasts = 0 # the number of broadcasts sent by this peer (used to give each broadcast its own ack type)
+        self.queries = 0 # the number of queries sent by this peer (used as the tag which matches the responses to a query)
+        self.query_responses = {} # the response to each query in progress by tag, None until the first response arrives
+        self.query_answered = threading.Condition() # a condition to wake up the query waiting for its response, which arrives on the p-port thread
+        self.query_started = {} # the time each find-event command still waiting for its own response was sent, and its deadline, by tag
+        self.query_latencies = collections.deque(maxlen=QUERY_LATENCY_WINDOW) # the latencies of the recent find-event commands (not of the hedged duplicates), used to decide when to hedge
+        self.ack_lock = threading.Lock() # a lock to protect the acks dictionary as acknowledgements arrive on the p-port thread
+        self.ack_received = threading.Condition(self.ack_lock) # a condition to wake up the broadcasts waiting for acknowledgements
         self.event_id_set = (5536849, 2402920, 5539287, 55770111)
-        self.listen_p_port = True # a flag to check if the peer should listen for messages from the peer nodes
-        self.teardown_complete = False # a flag to check if the teardown process is complete
+        self.hedges = 0 # the number of hedged duplicates of find-event commands sent by this peer
+        self.injected_delay = 0 # the number of seconds this peer waits before handling a find-event command, to benchmark slow peers (math.inf for a paused peer which never answers)
+        self.injected_delay_ratio = 1.0 # the fraction of the find-event commands the injected delay applies to
+        self.find_events = 0 # the number of find-event commands handled by this peer, to benchmark how a skewed load spreads over the peers
+        self.late_manager_replies = 0 # the number of query-dht commands whose reply from the manager (server) node did not come before the query gave up
         self.leaving_or_joining = False # a flag to check if the peer is leaving or joining the DHT network
+        if not standalone:
+            return
         # registering the peer with the manager (server) node
         self.register_with_manager()
 
@@ -60,56 +513,112 @@ class DHT_peer:
     # the method that listens for the messages from the peer nodes
     def receive_p_port(self):
         while True:
-            # check if the peer should listen for messages from the peer nodes
-            if not self.listen_p_port:
-                continue
-            p_data, p_address = self.p_port_socket.recvfrom(1024)
-            # decoding the message
-            p_data = p_data.decode('utf-8')
-            # print data
-            print(p_data)
-            #split the message into a list on the basis of space
-            p_data = p_data.split(" ",1)
-            # check the command received
-            if p_data[0] == "set_id": # if the command is set_id
-                set_id_thread = threading.Thread(target=self.set_id, args=(p_data[1],)) # create a thread for the set_id method
-                set_id_thread.start()
-            elif p_data[0] == "store": # if the command is store
-                store_dht_thread = threading.Thread(target=self.store_dht, args=(p_data[1],)) # create a thread for the store_dht method
-                store_dht_thread.start()
-            elif p_data[0] == "print_configuration": # if the command is print_configuration
-                print_configuration_thread = threading.Thread(target=self.print_configuration) # create a thread for the print_configuration method
-                print_configuration_thread.start()
-            elif p_data[0] == "find-event": # if the command is find-event
-                find_event_thread = threading.Thread(target=self.find_event, args=(p_data[1],))
-                find_event_thread.start()
-            elif p_data[0] == "teardown": # if the command is teardown
-                teardown_thread = threading.Thread(target=self.delete_local_hash_table) # create a thread for the teardown_dht method
-                teardown_thread.start()
-            elif p_data[0] == "reset-id":
-                reset_id_thread = threading.Thread(target=self.reset_id, args=(p_data[1],p_address[0], p_address[1]))
-                reset_id_thread.start()
-            elif p_data[0] == "join-dht":
-                join_rebuild_thread = threading.Thread(target=self.join_rebuild, args=(p_data[1],))
-                join_rebuild_thread.start()
-            elif p_data[0] == "rebuild-dht":
-                if self.leaving_or_joining:
-                    # this means that populating is done and the new leader has rebuilt the DHT network
-                    # send dht-rebuilt command to the manager (server) node
-                    # the command is of the form "dht-rebuilt <peer_name> <name of the new leader>"
-                    # find the new leader by checking the peers_DHT and comparing the IP address and port number
-                    new_leader = [peer for peer in self.peers_DHT if peer[1] == p_address[0] and peer[2] == p_address[1]]
-                    dht_rebuilt_command = "dht-rebuilt " + self.peer_name + " " + new_leader[0][0]
-                    self.m_port_socket.sendto(dht_rebuilt_command.encode('utf-8'), (self.manager_addres, self.manager_port))
-                    self.leaving_or_joining = False
-                    continue
-                self.populate_dht()
-                # after the populating has been done, send the rebuild-dht command back to the same peer
-                rebuild_dht_command = "rebuild-dht"
-                self.p_port_socket.sendto(rebuild_dht_command.encode('utf-8'), (p_address[0], p_address[1]))
-            else: # if the command is invalid
-                print("Invalid command received from the peer node.")
-    
+            p_data, p_address = self.p_port_socket.recvfrom(BUFFER_SIZE)
+            self.handle_p_message(p_data, p_address)
+
+    # the method that handles a message received on the p-port (called by the p-port thread, or by the host running the peer)
+    def handle_p_message(self, p_data, p_address):
+        # decompress the message if it is a compressed batch
+        if p_data.startswith(b"zlib "):
+            p_data = self.decompress_command(p_data)
+            if p_data is None:
+                return
+        # decoding the message
+        p_data = p_data.decode('utf-8')
+        # print data
+        print(p_data)
+        #split the message into a list on the basis of space
+        p_data = p_data.split(" ",1)
+        # check the command received
+        if p_data[0] == "set_id": # if the command is set_id
+            set_id_thread = threading.Thread(target=self.set_id, args=(p_data[1], p_address[0], p_address[1])) # create a thread for the set_id method
+            set_id_thread.start()
+        elif p_data[0] == "ack": # if the command is an acknowledgement of a broadcast, record it straight away (no thread needed)
+            self.receive_ack(p_data[1])
+        elif p_data[0] in ("SUCCESS", "FAILURE") and len(p_data) > 1: # if the message is the response to a query sent by this peer (tagged, so it can be matched to the query)
+            self.receive_query_response(p_data[0], p_data[1])
+        elif p_data[0] == "store": # if the command is store
+            store_dht_thread = threading.Thread(target=self.store_dht, args=(p_data[1],)) # create a thread for the store_dht method
+            store_dht_thread.start()
+        elif p_data[0] == "store-batch": # if the command is store-batch (many records sent straight to the peer storing them)
+            store_batch_thread = threading.Thread(target=self.receive_store_batch, args=(p_data[1], p_address[0], p_address[1]))
+            store_batch_thread.start()
+        elif p_data[0] == "set-table-size": # if the command is set-table-size (the leader announcing the size of the hash table, the data file and the virtual nodes of the peers before populating)
+            ack_type, table_size, data_path, ring_virtual_nodes = p_data[1].split(" ", 3)
+            self.set_placement(int(table_size), json.loads(ring_virtual_nodes))
+            self.data_path = data_path # kept so that this peer populates from the same file if it becomes the leader when rebuilding
+            self.bump_data_version() # the records are about to be placed again
+            ack_command = "ack " + ack_type + " " + self.peer_name
+            self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address[0], p_address[1]))
+        elif p_data[0] in ("put", "update", "delete"): # if the command is a single online write
+            write_thread = threading.Thread(target=self.write_record, args=(p_data[0], p_data[1]))
+            write_thread.start()
+        elif p_data[0] == "write-batch": # if the command is write-batch (a batch of writes from the write buffer of a client)
+            write_batch_thread = threading.Thread(target=self.write_batch, args=(p_data[1], p_address[0], p_address[1]))
+            write_batch_thread.start()
+        elif p_data[0] == "print_configuration": # if the command is print_configuration
+            print_configuration_thread = threading.Thread(target=self.report_configuration, args=(p_data[1], p_address[0], p_address[1])) # create a thread for the report_configuration method
+            print_configuration_thread.start()
+        elif p_data[0] == "get-ring": # if the command is get-ring (a querying peer asking for the list of peers in the DHT network)
+            ack_command = "ack " + p_data[1] + " " + self.peer_name + " " + json.dumps({"peers": self.peers_DHT, "table_size": self.table_size, "virtual_nodes": self.ring_virtual_nodes, "data_path": self.data_path})
+            self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address[0], p_address[1]))
+        elif p_data[0] == "set-dictionary": # if the command is set-dictionary (the leader offering the shared compression dictionary before populating)
+            self.set_dictionary(p_data[1], p_address[0], p_address[1])
+        elif p_data[0] == "get-virtual-nodes": # if the command is get-virtual-nodes (the leader asking for the number of virtual positions of this peer)
+            ack_command = "ack " + p_data[1] + " " + self.peer_name + " " + str(self.virtual_nodes)
+            self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address[0], p_address[1]))
+        elif p_data[0] == "get-bloom": # if the command is get-bloom (a querying peer asking for the bloom filter of this peer)
+            get_bloom_thread = threading.Thread(target=self.publish_bloom_filter, args=(p_data[1], p_address[0], p_address[1]))
+            get_bloom_thread.start()
+        elif p_data[0] == "find-range": # if the command is find-range (a querying peer asking for a page of the records in a range of event ids)
+            find_range_thread = threading.Thread(target=self.find_range_page, args=(p_data[1], p_address[0], p_address[1]))
+            find_range_thread.start()
+        elif p_data[0] == "find-event": # if the command is find-event
+            find_event_thread = threading.Thread(target=self.find_event, args=(p_data[1],))
+            find_event_thread.start()
+        elif p_data[0] == "cache-fill": # if the command is cache-fill (a forwarding peer asking the owner for the record of a hot event id)
+            cache_fill_thread = threading.Thread(target=self.send_cache_record, args=(p_data[1], p_address[0], p_address[1]))
+            cache_fill_thread.start()
+        elif p_data[0] == "bloom-version": # if the command is bloom-version (a peer whose bloom filter this peer fetched announcing that its records changed)
+            self.receive_bloom_version(p_data[1])
+        elif p_data[0] == "cache-record": # if the command is cache-record (the owner sending the record of a hot event id)
+            event = json.loads(p_data[1])
+            self.hot_keys.put(int(event[0]), event)
+        elif p_data[0] == "teardown": # if the command is teardown
+            teardown_thread = threading.Thread(target=self.delete_local_hash_table, args=(p_data[1], p_address[0], p_address[1])) # create a thread for the delete_local_hash_table method
+            teardown_thread.start()
+        elif p_data[0] == "reset-id":
+            reset_id_thread = threading.Thread(target=self.reset_id, args=(p_data[1],p_address[0], p_address[1]))
+            reset_id_thread.start()
+        elif p_data[0] == "join-dht":
+            join_rebuild_thread = threading.Thread(target=self.join_rebuild, args=(p_data[1],))
+            join_rebuild_thread.start()
+        elif p_data[0] == "rebuild-dht":
+            if self.leaving_or_joining:
+                # this means that populating is done and the new leader has rebuilt the DHT network
+                # send dht-rebuilt command to the manager (server) node
+                # the command is of the form "dht-rebuilt <peer_name> <name of the new leader>"
+                # find the new leader by checking the peers_DHT and comparing the IP address and port number
+                new_leader = [peer for peer in self.peers_DHT if peer[1] == p_address[0] and peer[2] == p_address[1]]
+                dht_rebuilt_command = "dht-rebuilt " + self.peer_name + " " + new_leader[0][0]
+                self.m_port_socket.sendto(dht_rebuilt_command.encode('utf-8'), (self.manager_addres, self.manager_port))
+                self.leaving_or_joining = False
+                return
+            # populate on a separate thread so that the acknowledgements of the populating can still be received
+            rebuild_dht_thread = threading.Thread(target=self.rebuild_dht, args=(p_address[0], p_address[1]))
+            rebuild_dht_thread.start()
+        else: # if the command is invalid
+            print("Invalid command received from the peer node.")
+
+    # the method that populates the DHT network again when rebuilding and sends the rebuild-dht command back to the peer that asked for it
+    def rebuild_dht(self, p_address, p_port):
+        if not self.populate_dht():
+            print("Rebuilding the DHT failed, as some peers did not acknowledge the populating.")
+            return
+        # after the populating has been done, send the rebuild-dht command back to the same peer
+        rebuild_dht_command = "rebuild-dht"
+        self.p_port_socket.sendto(rebuild_dht_command.encode('utf-8'), (p_address, p_port))
+
     # the method that registers the peer with the manager (server) node
     def register_with_manager(self):
         # first, send the command to the manager (server) node to register the peer
@@ -132,15 +641,15 @@ class DHT_peer:
             exit()
     
     # the method that sets up the DHT network
-    def setup_dht(self):
+    def setup_dht(self, size_n=5, year=1996):
         # first, send the command to the manager (server) node to setup the DHT network
         # the command is of the form "setup-dht <peer_name> <n> <YYYY>"
-        setup_dht_command = "setup-dht " + self.peer_name + " " + str(5) + " " + str(1996)
+        setup_dht_command = "setup-dht " + self.peer_name + " " + str(size_n) + " " + str(year)
         self.m_port_socket.sendto(setup_dht_command.encode('utf-8'), (self.manager_addres, self.manager_port)) # sending the command to the manager (server) node
 
         # wait for the response from the manager (server) node
         # the response is either of the form "FAILURE: <reason>" or "SUCCESS <a string containing the dht_list 3-tuple elements of the form (peer_name, peer_ipv4, p_port)>"
-        response, manager_address = self.m_port_socket.recvfrom(1024)
+        response, manager_address = self.m_port_socket.recvfrom(BUFFER_SIZE)
         response = response.decode('utf-8') # decoding the response
         print("breakpoint1")
 
@@ -149,25 +658,28 @@ class DHT_peer:
             _, dht_list_str = response.split("\n",1) # splitting the response to get the dht_list string
             dht_list = ast.literal_eval(dht_list_str) # converting the string to list
             self.peers_DHT = [(peer_name, peer_ipv4, int(p_port)) for peer_name, peer_ipv4, p_port in dht_list] # converting the list of strings to list of 3-tuple elements
+        else:
+            # print the response to better understand the reason for failure
+            print(response)
+            return
         
         print("breakpoint2")
         self.id = 0 # the identifier of the peer in the DHT network as it is the leader
-        self.ring_size = 5 # the size of the ring in the DHT network
+        self.ring_size = len(self.peers_DHT) # the size of the ring in the DHT network
         self.right_neighbour = self.peers_DHT[(self.id+1)%self.ring_size] # setting the right neighbour of the peer in the DHT network
         print("Peer " + self.peer_name + " has been set up with the following details:")
         print("Identifier: " + str(self.id))
         print("Ring size: " + str(self.ring_size))
+        self.data_path = 'details-' + str(year) + '.csv' # the storm events of the year given to the manager
 
-        # send the set_id command to the right neigbour of the peer in the DHT network
-        set_id_command = "set_id " + str(self.id+1) + " " + str(self.ring_size) + " " + json.dumps(self.peers_DHT)
-        self.p_port_socket.sendto(set_id_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
-
-        # wait until all the peers have identifiers and the ring size set
-        while not self.can_populate:
-            pass
+        # send every peer its identifier and the ring view in parallel and wait until all of them have acknowledged it
+        if not self.configure_ring():
+            return
 
-        # populate the local hash table of the peer
-        self.populate_dht()
+        # populate the local hash table of the peer, and only report the DHT as complete once every peer has acknowledged its records
+        if not self.populate_dht():
+            print("Setting up the DHT failed, as some peers did not acknowledge the populating.")
+            return
 
         # print the configuration of the local hash table of the peer
         self.print_configuration()
@@ -181,50 +693,231 @@ class DHT_peer:
         response, _ = self.m_port_socket.recvfrom(1024)
         response = response.decode('utf-8') # decoding the response
 
+    # a method that sends a command to every other peer in the DHT network (or to the given list of targets) in parallel and waits until all of them have acknowledged it
+    # build_command is called with the 3-tuple (peer_name, peer_ipv4, p_port) of each target and returns the command to send to it
+    # the ack type is made unique to this broadcast (ack_type-<n>) and is put after the first word of each command, so the commands are sent
+    # in the form "<command> <ack_type> <arguments>" and the peers acknowledge them with "ack <ack_type> <peer_name> <payload>"
+    # returns the dictionary { <peer_name>: <payload of the ack> } or None if some peers did not acknowledge before the timeout
+    # (or, if partial is True, the dictionary of the acknowledgements received before the timeout)
+    # if compress is True the large commands are compressed with the shared dictionary
+    def broadcast(self, ack_type, build_command, targets=None, timeout=ACK_TIMEOUT, partial=False, compress=False):
+        if targets is None:
+            targets = [peer for peer in self.peers_DHT if peer[0] != self.peer_name]
+        targets = {peer[0]: peer for peer in targets}
+        with self.ack_lock:
+            self.broadcasts += 1
+            ack_type = ack_type + "-" + str(self.broadcasts)
+            self.acks[ack_type] = {}
+        commands = {}
+        for peer_name, peer in targets.items():
+            command, _, arguments = build_command(peer).partition(" ")
+            commands[peer_name] = self.encode_command(command + " " + ack_type + (" " + arguments if arguments else ""), compress)
+
+        start = time.monotonic()
+        missing = list(targets)
+        while True:
+            # (re)send the command to every peer which has not acknowledged it yet
+            for peer_name in missing:
+                self.p_port_socket.sendto(commands[peer_name], (targets[peer_name][1], targets[peer_name][2]))
+            # wait for the acknowledgements, retransmitting after ACK_RETRY_INTERVAL in case a datagram was lost
+            retry_at = min(time.monotonic() + ACK_RETRY_INTERVAL, start + timeout)
+            with self.ack_received:
+                while True:
+                    missing = [peer_name for peer_name in targets if peer_name not in self.acks[ack_type]]
+                    if not missing:
+                        return self.acks.pop(ack_type)
+                    if time.monotonic() >= retry_at:
+                        break
+                    self.ack_received.wait(retry_at - time.monotonic())
+            if time.monotonic() - start >= timeout:
+                print("Peers " + str(missing) + " did not acknowledge " + ack_type + ".")
+                with self.ack_lock:
+                    acks = self.acks.pop(ack_type)
+                return acks if partial else None
+
+    # the method that records an acknowledgement of a broadcast sent by this peer
+    def receive_ack(self, p_data):
+        # the ack is of the form "ack <ack_type> <peer_name> <payload>" where the payload may be empty
+        p_data = p_data.split(" ", 2)
+        ack_type = p_data[0]
+        peer_name = p_data[1]
+        payload = p_data[2] if len(p_data) > 2 else ""
+        with self.ack_lock:
+            # ignore late or duplicate acknowledgements of broadcasts which are no longer in progress
+            if ack_type in self.acks:
+                self.acks[ack_type][peer_name] = payload
+                self.ack_received.notify_all()
+
+    # the method that sends every peer in the DHT network its identifier and the ring view in parallel
+    def configure_ring(self):
+        # the ring view is the same for all the peers so it is only encoded once
+        peers_DHT_json = json.dumps(self.peers_DHT)
+        ids = {peer[0]: peer_id for peer_id, peer in enumerate(self.peers_DHT)}
+        acks = self.broadcast("set_id", lambda peer: "set_id " + str(ids[peer[0]]) + " " + str(self.ring_size) + " " + peers_DHT_json)
+        return acks is not None
     
     # the method that sets the identifier of the peer in the DHT network
-    def set_id(self, p_data):
-        # if the id is already set, then return as the assingment process is complete
-        if self.id is not None:
-            self.can_populate = True
-            return
-        #split the p_data into three variables
-        p_data = p_data.split(" ",2)
-        self.id = int(p_data[0]) # the identifier of the peer in the DHT network
-        self.ring_size = int(p_data[1])
-        self.peers_DHT = json.loads(p_data[2]) # the list of peers in the DHT network
-        self.local_hash_table = {} # the local hash table of the peer
+    # the leader resends set_id until it is acknowledged, and only a different id or ring clears the local hash table,
+    # so a resent set_id which arrives after the records have started being stored is only acknowledged again
+    def set_id(self, p_data, p_address, p_port):
+        #split the p_data into four variables (the ack type of the broadcast, id, ring_size and the list of peers)
+        ack_type, *p_data = p_data.split(" ",3)
+        configured_ring = (int(p_data[0]), int(p_data[1]), p_data[2])
+        if configured_ring != self.configured_ring:
+            self.clear_local_hash_table()
+            self.id = configured_ring[0] # the identifier of the peer in the DHT network
+            self.ring_size = configured_ring[1]
+            self.peers_DHT = json.loads(p_data[2]) # the list of peers in the DHT network
+            self.configured_ring = configured_ring
 
-        # setting the right neighbour of the peer in the DHT network
-        self.right_neighbour = self.peers_DHT[(self.id+1)%self.ring_size]
-        print("Peer " + self.peer_name + " has been set up with the following details:")
-        print("Identifier: " + str(self.id))
-        print("Ring size: " + str(self.ring_size))
+            # setting the right neighbour of the peer in the DHT network
+            self.right_neighbour = self.peers_DHT[(self.id+1)%self.ring_size]
+            print("Peer " + self.peer_name + " has been set up with the following details:")
+            print("Identifier: " + str(self.id))
+            print("Ring size: " + str(self.ring_size))
 
-        # send the set_id command to the right neigbour of the peer
-        set_id_command = "set_id " + str(self.id+1) + " " + str(self.ring_size) + " " + json.dumps(self.peers_DHT)
-        self.p_port_socket.sendto(set_id_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
+        # acknowledge the identifier to the peer which sent the set_id command (the leader)
+        ack_command = "ack " + ack_type + " " + self.peer_name
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
 
     # a method for populating the local hash table of the peer
-    def populate_dht(self):
-        # open the csv file containing the data to be stored in the local hash tables of the peers
-        with open (f'details-1996.csv', 'r') as file: # open the csv file in read mode
-            reader = csv.reader(file) # create a reader object
-            next(reader) # skip the header row
-            events = list(reader) # convert the reader object to a list (easy to iterate over)
-            s = self.next_prime(2 * len(events)) # find the next prime number 2 times greater than the number of events
-            for event in events: # iterate over the events
-                event_id = int(event[0]) # the event id of the event
-                pos = event_id % s # the position of the event in the local hash table
-                id = pos % self.ring_size # the identifier of the peer in the DHT network that is responsible for storing the event
-                if id == self.id: # if the current peer is the intended peer for storing the event
-                    self.local_hash_table[pos] = event # store the event in the local hash table of the peer
-                else:
-                    # send the store command to the right neigbour of the peer
-                    store_command = "store " + str(pos) + " " + json.dumps(event)
-                    self.p_port_socket.sendto(store_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
-        self.can_populate = False
-            
+    # the csv file is streamed in chunks of INGEST_CHUNK_BYTES which are parsed and hashed by a pool of INGEST_WORKERS processes,
+    # and the batches of records for each peer are sent straight to that peer as soon as a chunk has been parsed
+    # the path defaults to the data file set when setting up the DHT network, so rebuilding uses the same year
+    # returns True if every peer acknowledged all its records and False otherwise
+    def populate_dht(self, path=None):
+        if path is None:
+            path = self.data_path
+        chunks = list(split_csv(path, INGEST_CHUNK_BYTES)) # the byte ranges of the csv file (only the offsets are kept in memory)
+        if INGEST_WORKERS > 1 and len(chunks) > 1:
+            with multiprocessing.get_context('spawn').Pool(INGEST_WORKERS) as pool:
+                return self.ingest_chunks(path, chunks, lambda function, args: pool.apply_async(function, args))
+        # a single chunk or a single core is parsed in this process as starting the pool would cost more than it saves
+        return self.ingest_chunks(path, chunks, None)
+
+    # a method that counts, parses and hashes the chunks of the csv file and sends the batches of records to the peers
+    # submit is either None (run in this process) or a function which runs a function in the pool and returns its AsyncResult
+    # returns True if every peer acknowledged all its records and False otherwise
+    def ingest_chunks(self, path, chunks, submit):
+        def run(function, args):
+            if submit is None:
+                return function(*args)
+            return submit(function, args)
+        def result(task):
+            return task if submit is None else task.get()
+
+        # find the next prime number 2 times greater than the number of events
+        s = self.next_prime(2 * sum(result(task) for task in [run(count_csv_range, (path, start, end)) for start, end in chunks]))
+
+        # ask all the peers for their number of virtual nodes, so that each peer stores a share of the records in proportion to it
+        acks = self.broadcast("virtual-nodes", lambda peer: "get-virtual-nodes")
+        if acks is None:
+            return False
+        ring_virtual_nodes = [self.virtual_nodes if peer[0] == self.peer_name else int(acks[peer[0]]) for peer in self.peers_DHT]
+
+        # tell all the peers the size of the hash table and the virtual nodes so that they can place online writes and find events,
+        # and the data file so that any of them can populate the DHT network again if it becomes the leader
+        self.set_placement(s, ring_virtual_nodes)
+        self.data_path = path
+        if self.broadcast("table-size", lambda peer: "set-table-size " + str(s) + " " + path + " " + json.dumps(ring_virtual_nodes)) is None:
+            return False
+
+        # train the compression dictionary on the first chunk of the csv file and offer it to all the peers
+        # the store batches are only compressed if every peer accepts it
+        self.dictionary = train_dictionary(read_csv_range(path, *chunks[0])) if chunks else b""
+        self.dictionary_id = hashlib.blake2b(self.dictionary, digest_size=8).hexdigest()
+        dictionary_command = "set-dictionary " + self.dictionary_id + " " + base64.b64encode(self.dictionary).decode('ascii')
+        acks = self.broadcast("dictionary", lambda peer: dictionary_command)
+        if acks is None:
+            return False
+        self.compress_batches = all(payload == "zlib" for payload in acks.values())
+
+        # keep at most two chunks per process in flight so the memory used does not depend on the size of the file
+        in_flight = collections.deque()
+        for start, end in chunks:
+            in_flight.append(run(shard_csv_range, (path, start, end, s, self.slots, self.ring_size)))
+            if len(in_flight) >= 2 * INGEST_WORKERS:
+                if not self.send_store_batches(result(in_flight.popleft())):
+                    return False
+        while in_flight:
+            if not self.send_store_batches(result(in_flight.popleft())):
+                return False
+        return True
+
+    # a method that stores the batches of records for this peer and sends the other batches straight to the peers storing them
+    # the batches are sent in rounds, one batch to each peer which has one left, and every peer acknowledges its batch before the next round
+    # returns True if every peer acknowledged all its batches and False otherwise
+    def send_store_batches(self, batches):
+        others = {}
+        for id, payloads in batches.items():
+            if id == self.id: # if the current peer is the intended peer for storing the records
+                for payload in payloads:
+                    self.store_batch(payload)
+            else:
+                others[self.peers_DHT[id][0]] = payloads
+        for i in range(max((len(payloads) for payloads in others.values()), default=0)):
+            targets = [peer for peer in self.peers_DHT if len(others.get(peer[0], ())) > i]
+            if self.broadcast("store", lambda peer: "store-batch " + others[peer[0]][i], targets=targets, compress=self.compress_batches) is None:
+                return False
+        return True
+
+    # a method that stores a batch of records sent by the store-batch command and acknowledges it
+    # a batch sent again because the acknowledgement was lost is stored again, which leaves the same records in the local hash table
+    def receive_store_batch(self, p_data, p_address, p_port):
+        # the p_data is of the form "<ack_type> <json list of [pos, event] pairs>"
+        ack_type, payload = p_data.split(" ", 1)
+        self.store_batch(payload)
+        ack_command = "ack " + ack_type + " " + self.peer_name
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
+
+    # a method for storing a batch of records sent by the store-batch command in the local hash table of the peer
+    def store_batch(self, p_data):
+        # the p_data is a json list of [pos, event] pairs
+        for pos, event in json.loads(p_data):
+            if owner_of(pos, self.slots, self.ring_size) == self.id: # if the current peer is the intended peer for storing the data
+                self.store_local(pos, event)
+            else:
+                # the ring has changed since the batch was made, so pass the record on like the store command does
+                store_command = "store " + str(pos) + " " + json.dumps(event)
+                self.p_port_socket.sendto(store_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
+        self.bump_data_version()
+
+    # a method that stores the shared compression dictionary offered by the leader and accepts it
+    def set_dictionary(self, p_data, p_address, p_port):
+        # the p_data is of the form "<ack_type> <dictionary_id> <base64 encoded dictionary>"
+        ack_type, dictionary_id, dictionary = p_data.split(" ", 2)
+        self.dictionary = base64.b64decode(dictionary)
+        self.dictionary_id = dictionary_id
+        # the payload of the acknowledgement is the compression this peer accepts
+        ack_command = "ack " + ack_type + " " + self.peer_name + " zlib"
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
+
+    # a method that sends a command to a peer, compressed with the shared dictionary if compress is True and the command is large enough
+    def send_command(self, command, address, compress):
+        self.p_port_socket.sendto(self.encode_command(command, compress), address)
+
+    # a method that encodes a command, compressed with the shared dictionary if compress is True and the command is large enough
+    def encode_command(self, command, compress):
+        data = command.encode('utf-8')
+        if compress and self.dictionary is not None and len(data) >= COMPRESSION_THRESHOLD:
+            data = compress_command(data, self.dictionary, self.dictionary_id) or data
+        return data
+
+    # a method that decompresses a command compressed by compress_command, or returns None if it used a different dictionary
+    def decompress_command(self, data):
+        _, dictionary_id, compressed = data.split(b" ", 2)
+        if dictionary_id.decode('ascii') != self.dictionary_id:
+            print("Dropped a command compressed with an unknown dictionary.")
+            return None
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return decompressor.decompress(compressed) + decompressor.flush()
+
+    # a method that sets the size of the hash table and the virtual nodes of the peers in the DHT network, which decide where each record is stored
+    def set_placement(self, table_size, ring_virtual_nodes):
+        self.table_size = table_size
+        self.ring_virtual_nodes = ring_virtual_nodes
+        self.slots = assign_virtual_nodes(ring_virtual_nodes)
+
     # a method for the finding the next prime number 2 times greater than n
     def next_prime(self, n):
         while True: # keep iterating until a prime number is found
@@ -245,110 +938,624 @@ class DHT_peer:
         event = json.loads(p_data[1]) # the data to be stored in the local hash table
 
         # check if the current peer is the intended peer for storing the data
-        id = pos % self.ring_size
+        id = owner_of(pos, self.slots, self.ring_size)
         if id == self.id: # if the current peer is the intended peer for storing the data
-            self.local_hash_table[pos] = event # store the data in the local hash table of the peer
+            self.store_local(pos, event) # store the data in the local hash table of the peer
+            self.bump_data_version()
             print("Data stored successfully in the local hash table of the peer " + self.peer_name + ".")
         else:
             # send the store command to the right neigbour of the peer
             store_command = "store " + str(pos) + " " + json.dumps(event)
             self.p_port_socket.sendto(store_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
 
-    # a method that prints the number of records stored in each node of the DHT network
-    def print_configuration(self):
+    # a method that stores a record in the local hash table of the peer and adds it to the bloom filter and the event index
+    def store_local(self, pos, event):
+        self.local_hash_table[pos] = event
+        self.add_to_bloom_filter(int(event[0]))
+        with self.event_index_lock:
+            # the index is only sorted when a range query needs it, so bulk loads append in O(1)
+            self.event_index.append((int(event[0]), pos))
+            self.event_index_sorted = False
+
+    # a method that applies a single online write (op is "put", "update" or "delete") if this peer stores the event id, or passes it on otherwise
+    # the p_data is the json encoded event for put and update, and the event id for delete
+    def write_record(self, op, p_data):
+        event_id = int(p_data) if op == "delete" else int(json.loads(p_data)[0])
+        pos = event_id % self.table_size
+        if owner_of(pos, self.slots, self.ring_size) == self.id: # if the current peer is the intended peer for storing the data
+            if self.apply_write(op, event_id, None if op == "delete" else json.loads(p_data)) == "applied" and op != "delete":
+                self.bump_data_version()
+        else:
+            # send the write to the right neighbour of the peer, the same way the store command is passed on
+            write_command = op + " " + p_data
+            self.p_port_socket.sendto(write_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
+
+    # a method that applies a write to the local hash table of the peer
+    # returns "applied" if the write was applied, "missing" if the record to update or delete does not exist,
+    # and "collision" if a put was refused because the position in the hash table holds the record of a different event id
+    def apply_write(self, op, event_id, event):
+        pos = event_id % self.table_size
+        current = self.local_hash_table.get(pos)
+        exists = current is not None and int(current[0]) == event_id
+        if op == "put" and current is not None and not exists:
+            print("FAILURE: position " + str(pos) + " already holds storm event " + str(current[0]))
+            return "collision"
+        if op == "put" or (op == "update" and exists):
+            self.store_local(pos, event)
+            return "applied"
+        if op == "delete" and exists:
+            # the bloom filter and the event index keep the event id, which only costs a wasted lookup
+            self.local_hash_table.pop(pos, None)
+            return "applied"
+        return "missing"
+
+    # a method that applies a batch of writes sent by the write buffer of a client and acknowledges it with the number of writes applied
+    def write_batch(self, p_data, p_address, p_port):
+        # the p_data is of the form "<ack_type> <json list of [op, event_id, event] writes>"
+        ack_type, writes = p_data.split(" ", 1)
+        results = {"applied": 0, "missing": 0, "collision": 0, "forwarded": 0}
+        for op, event_id, event in json.loads(writes):
+            if owner_of(event_id % self.table_size, self.slots, self.ring_size) == self.id:
+                results[self.apply_write(op, event_id, event)] += 1
+            else:
+                # the ring has changed since the client fetched it, so pass the write on like a single write
+                self.write_record(op, str(event_id) if op == "delete" else json.dumps(event))
+                results["forwarded"] += 1
+        # announce the new records to the peers holding the bloom filter of this peer before the client learns that they are stored
+        if results["applied"]:
+            self.bump_data_version()
+        ack_command = "ack " + ack_type + " " + self.peer_name + " " + json.dumps(results)
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
+
+    # a method that returns the list of peers in the DHT network, the table size and the virtual positions in the form { "peers": [...], "table_size": s, "slots": [...] }
+    # a peer in the DHT network knows them, while a client fetches them through the manager and caches them for RING_REFRESH_INTERVAL
+    def get_ring_view(self):
+        if self.id is not None and self.peers_DHT is not None:
+            return {"peers": self.peers_DHT, "table_size": self.table_size, "slots": self.slots}
+        if self.ring_view is None or time.monotonic() - self.ring_view_fetched_at > RING_REFRESH_INTERVAL:
+            peer_in_DHT = self.request_peer_in_DHT()
+            if peer_in_DHT is None:
+                return None
+            self.ring_view = self.fetch_ring(peer_in_DHT)
+            if self.ring_view is None:
+                return None
+            self.ring_view["slots"] = assign_virtual_nodes(self.ring_view["virtual_nodes"]) if self.ring_view["virtual_nodes"] else None
+            self.ring_view_fetched_at = time.monotonic()
+        return self.ring_view
+
+    # the methods that buffer online writes of single records (they are sent when the write buffer is flushed)
+    def put(self, event):
+        return self.buffer_write("put", int(event[0]), event)
+
+    def update(self, event):
+        return self.buffer_write("update", int(event[0]), event)
+
+    def delete(self, event_id):
+        return self.buffer_write("delete", int(event_id))
+
+    # a method that adds a write to the write buffer of the peer, creating the buffer on the first write
+    def buffer_write(self, op, event_id, event=None):
+        if self.write_buffer is None:
+            self.write_buffer = WriteBuffer(self)
+        return self.write_buffer.add(op, event_id, event)
+
+    # a method that sends all the buffered writes straight away
+    def flush_writes(self):
+        if self.write_buffer is None:
+            return True
+        return self.write_buffer.flush()
+
+    # a method that empties the local hash table of the peer along with its bloom filter and event index
+    def clear_local_hash_table(self):
+        self.local_hash_table = {}
+        self.slots = None # the ring may have changed, so the virtual positions are sent again when populating
+        self.hot_keys.clear() # the records may belong to a different ring, so they are not served any more
+        with self.bloom_lock:
+            self.bloom_filter = BloomFilter(BLOOM_INITIAL_CAPACITY, self.bloom_false_positive_rate)
+        with self.event_index_lock:
+            self.event_index = []
+            self.event_index_sorted = True
+        self.bump_data_version()
+
+    # a method that adds the event id of a newly stored record to the bloom filter of the peer
+    def add_to_bloom_filter(self, event_id):
+        with self.bloom_lock:
+            if self.bloom_filter.count >= self.bloom_filter.capacity:
+                # the filter is full, so rebuild it with twice the capacity from the event ids in the local hash table
+                # (the new event is already in the local hash table, so it is included in the rebuild)
+                self.bloom_filter = BloomFilter(self.bloom_filter.capacity * 2, self.bloom_false_positive_rate)
+                for event in list(self.local_hash_table.values()):
+                    self.bloom_filter.add(int(event[0]))
+            else:
+                self.bloom_filter.add(event_id)
 
-        # if the configuration has already been printed, then return
-        if self.printed:
+    # a method that increases the data version of the peer and announces it with the bloom-version command to the peers which fetched its bloom filter recently
+    # (a peer which fetched it more than BLOOM_REFRESH_INTERVAL ago no longer answers queries from it, so it is not told)
+    def bump_data_version(self):
+        now = time.monotonic()
+        with self.bloom_lock:
+            self.data_version += 1
+            version = self.data_version
+            self.bloom_subscribers = {address: fetched_at for address, fetched_at in self.bloom_subscribers.items() if now - fetched_at <= BLOOM_REFRESH_INTERVAL}
+            subscribers = list(self.bloom_subscribers)
+        bloom_version_command = ("bloom-version " + self.peer_name + " " + str(version)).encode('utf-8')
+        for address in subscribers:
+            self.p_port_socket.sendto(bloom_version_command, address)
+
+    # a method that replies to the get-bloom command with the data version of the peer and the requested part of its bloom filter
+    def publish_bloom_filter(self, p_data, p_address, p_port):
+        # the p_data is of the form "<ack_type> <part>"
+        ack_type, part = p_data.split(" ")
+        with self.bloom_lock:
+            bloom_filter_json = self.bloom_filter.to_json(int(part))
+            version = self.data_version
+            self.bloom_subscribers[(p_address, p_port)] = time.monotonic()
+        ack_command = "ack " + ack_type + " " + self.peer_name + " " + str(version) + " " + bloom_filter_json
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
+
+    # a method that drops the bloom filter fetched from a peer which announced a newer data version with the bloom-version command
+    # until the filter is fetched again (by the next query) the queries are sent to the DHT network, as the filter may not know the new records
+    def receive_bloom_version(self, p_data):
+        peer_name, version = p_data.split(" ")
+        version = int(version)
+        with self.bloom_filters_lock:
+            self.bloom_versions[peer_name] = max(version, self.bloom_versions.get(peer_name, version))
+            entry = self.bloom_filters.get(peer_name)
+            if entry is not None and entry[2] < version:
+                del self.bloom_filters[peer_name]
+                self.bloom_filters_fetched_at = 0
+
+    # a method that asks the given peer in the DHT network for the list of peers in the DHT network and the table size
+    # returns them in the form { "peers": [...], "table_size": s, "virtual_nodes": [...], "data_path": path } or None if the peer did not reply before the timeout
+    def fetch_ring(self, peer_in_DHT, timeout=ACK_TIMEOUT):
+        acks = self.broadcast("ring", lambda peer: "get-ring", targets=[peer_in_DHT], timeout=timeout)
+        if acks is None:
+            return None
+        return json.loads(acks[peer_in_DHT[0]])
+
+    # a method that fetches the bloom filters of all the peers in the DHT network through the given peer in the DHT network
+    # this is best effort: the peers which do not reply within BLOOM_FETCH_TIMEOUT keep the filter fetched from them last time (if any)
+    def fetch_bloom_filters(self, peer_in_DHT):
+        self.bloom_filters_fetched_at = time.monotonic()
+        with self.bloom_filters_lock:
+            self.written_event_ids = []
+        # first, ask the peer in the DHT network for the list of peers in the DHT network
+        ring = self.fetch_ring(peer_in_DHT, timeout=BLOOM_FETCH_TIMEOUT)
+        if ring is None:
+            with self.bloom_filters_lock:
+                self.written_event_ids = None
             return
+        # the ring view of a client is refreshed at the same time, as the queries use it to choose the peer to send a hedged duplicate to
+        if self.id is None:
+            ring["slots"] = assign_virtual_nodes(ring["virtual_nodes"]) if ring["virtual_nodes"] else None
+            self.ring_view = ring
+            self.ring_view_fetched_at = time.monotonic()
 
-        self.printed = True
-        print("The number of records stored in the local hash table of the peer " + self.peer_name + " is " + str(len(self.local_hash_table)) + ".")
+        # then ask all the peers in the DHT network for the first part of their bloom filters in parallel
+        # a filter too large for one datagram is sent in parts, so the other parts are asked from the peers whose filter has them
+        peers = {peer[0]: peer for peer in ring["peers"]}
+        acks = self.broadcast("bloom", lambda peer: "get-bloom 0", targets=list(peers.values()), timeout=BLOOM_FETCH_TIMEOUT, partial=True)
+        # each part is of the form "<data version> <json>", and a filter whose data version changed between its parts is dropped
+        versions = {peer_name: int(payload.split(" ", 1)[0]) for peer_name, payload in acks.items()}
+        parts = {peer_name: [payload.split(" ", 1)[1]] for peer_name, payload in acks.items()}
+        part = 1
+        while True:
+            targets = [peers[peer_name] for peer_name, payloads in parts.items() if json.loads(payloads[0])["parts"] > part]
+            if not targets:
+                break
+            acks = self.broadcast("bloom", lambda peer: "get-bloom " + str(part), targets=targets, timeout=BLOOM_FETCH_TIMEOUT, partial=True)
+            for peer in targets:
+                version, _, payload = acks.get(peer[0], "").partition(" ")
+                if version == str(versions[peer[0]]):
+                    parts[peer[0]].append(payload)
+                else:
+                    del parts[peer[0]]
+            part += 1
 
-        # send a command to the right neighbour of the peer to print the configuration of the local hash table of the peer
-        print_configuration_command = "print_configuration"
-        self.p_port_socket.sendto(print_configuration_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
+        # keep the filters of the peers which are still in the DHT network, replacing those which were fetched now
+        # a filter older than a data version announced during the fetch is not kept, and
+        # the event ids written by this peer during the fetch may be missing from the new filters, so they are added again
+        fetched_at = time.monotonic()
+        with self.bloom_filters_lock:
+            bloom_filters = {peer_name: self.bloom_filters[peer_name] for peer_name in peers if peer_name in self.bloom_filters}
+            for peer_name, payloads in parts.items():
+                bloom_filter = BloomFilter.from_json(payloads)
+                if bloom_filter is not None and versions[peer_name] >= self.bloom_versions.get(peer_name, 0):
+                    bloom_filters[peer_name] = (bloom_filter, fetched_at, versions[peer_name])
+            self.bloom_filters = bloom_filters
+            self.bloom_peers = list(peers)
+            self.add_to_bloom_filters(self.written_event_ids)
+            self.written_event_ids = None
 
-    # a method that queries the DHT for a specific event_id record
-    def query_dht(self):
-        # first, send the command to the manager (server) node to query the DHT network
+    # a method that starts fetching the bloom filters through the given peer in the DHT network on a separate thread, unless a fetch is already in progress
+    def refresh_bloom_filters(self, peer_in_DHT):
+        with self.bloom_filters_lock:
+            if self.bloom_refresh_thread is not None:
+                return
+            self.bloom_refresh_thread = threading.Thread(target=self.run_bloom_refresh, args=(peer_in_DHT,), daemon=True)
+            self.bloom_refresh_thread.start()
+
+    # the method run by the thread started by refresh_bloom_filters
+    def run_bloom_refresh(self, peer_in_DHT):
+        try:
+            self.fetch_bloom_filters(peer_in_DHT)
+        finally:
+            with self.bloom_filters_lock:
+                self.bloom_refresh_thread = None
+
+    # a method that adds the event ids put or updated by this peer to the bloom filters fetched from the peers storing them
+    # written is a list of (peer_name, event_id) pairs, where a peer_name of None adds the event id to the filters of all the peers
+    def add_written_event_ids(self, written):
+        with self.bloom_filters_lock:
+            self.add_to_bloom_filters(written)
+            if self.written_event_ids is not None:
+                self.written_event_ids += written
+
+    # a method that adds (peer_name, event_id) pairs to the fetched bloom filters (called with the bloom_filters lock held)
+    def add_to_bloom_filters(self, written):
+        for peer_name, event_id in written:
+            for name, (bloom_filter, _, _) in self.bloom_filters.items():
+                if peer_name is None or name == peer_name:
+                    bloom_filter.add(event_id)
+
+    # a method that returns True if the bloom filters fetched from the DHT network show that the event id is definitely not stored
+    # this needs a filter fetched in the last BLOOM_REFRESH_INTERVAL from every peer in the DHT network, as a peer without one may store the event id
+    def is_definite_miss(self, event_id):
+        if self.bloom_peers is None:
+            return False
+        now = time.monotonic()
+        bloom_filters = [self.bloom_filters.get(peer_name) for peer_name in self.bloom_peers]
+        if any(entry is None or now - entry[1] > BLOOM_REFRESH_INTERVAL for entry in bloom_filters):
+            return False
+        return not any(bloom_filter.might_contain(event_id) for bloom_filter, _, _ in bloom_filters)
+
+    # a method that collects the number of records stored in each node of the DHT network in parallel
+    # returns a report of the form { "peers": [<the local configuration of each peer ordered by id>], "records": <total>, "bytes": <total> } or None if some peers did not reply
+    def print_configuration(self):
+        # ask every other peer for its local configuration and add the local configuration of this peer
+        acks = self.broadcast("configuration", lambda peer: "print_configuration")
+        if acks is None:
+            return None
+        configurations = [json.loads(payload) for payload in acks.values()] + [self.local_configuration()]
+        configurations.sort(key=lambda configuration: configuration["id"])
+
+        report = {
+            "peers": configurations,
+            "records": sum(configuration["records"] for configuration in configurations),
+            "bytes": sum(configuration["bytes"] for configuration in configurations),
+        }
+        # the imbalance ratio of a peer is the number of records it stores divided by its share of the records by virtual nodes (1 is perfectly balanced)
+        virtual_nodes = sum(configuration["virtual_nodes"] for configuration in configurations)
+        for configuration in configurations:
+            expected = report["records"] * configuration["virtual_nodes"] / virtual_nodes
+            configuration["imbalance"] = round(configuration["records"] / expected, 3) if expected else 0
+        report["imbalance"] = max(configuration["imbalance"] for configuration in configurations)
+        for configuration in configurations:
+            print("The number of records stored in the local hash table of the peer " + configuration["peer_name"] + " is " + str(configuration["records"]) + " (" + str(configuration["virtual_nodes"]) + " virtual nodes, imbalance ratio " + str(configuration["imbalance"]) + ").")
+        print("The total number of records stored in the DHT is " + str(report["records"]) + ".")
+        print("The highest imbalance ratio is " + str(report["imbalance"]) + ".")
+        return report
+
+    # a method that computes the configuration of the local hash table of the peer
+    def local_configuration(self):
+        return {
+            "id": self.id,
+            "peer_name": self.peer_name,
+            "records": len(self.local_hash_table), # the number of records stored in the local hash table
+            "bytes": sum(len(json.dumps(event)) for event in list(self.local_hash_table.values())), # the size of the records as they are sent over the network
+            "index_bytes": sys.getsizeof(self.local_hash_table), # the memory used by the local hash table itself
+            "bloom_bytes": len(self.bloom_filter.bits), # the memory used by the bits of the bloom filter
+            "event_index_bytes": sys.getsizeof(self.event_index) + len(self.event_index) * (sys.getsizeof((0, 0)) + 2 * sys.getsizeof(0)), # the memory used by the sorted index of event ids (approximately)
+            "cached_records": len(self.hot_keys.records), # the number of records of hot event ids cached by the peer
+            "cache_hits": self.hot_keys.hits, # the number of find-event commands answered from the cache
+            "find_events": self.find_events, # the number of find-event commands handled by the peer
+            "virtual_nodes": self.virtual_nodes, # the number of virtual positions the peer owns
+        }
+
+    # a method that replies to the print_configuration command with the configuration of the local hash table of the peer
+    def report_configuration(self, ack_type, p_address, p_port):
+        configuration = self.local_configuration()
+        print("The number of records stored in the local hash table of the peer " + self.peer_name + " is " + str(configuration["records"]) + ".")
+        ack_command = "ack " + ack_type + " " + self.peer_name + " " + json.dumps(configuration)
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
+
+    # a method that asks the manager (server) node for a random peer in the DHT network to send a query to
+    # returns the 3-tuple (peer_name, peer_ipv4, p_port) of the peer or None if the manager refused the query
+    # gives up after timeout seconds (None waits for ever) and returns None, in which case the late reply is dropped by the next call
+    def request_peer_in_DHT(self, timeout=None):
+        # drop the replies to earlier query-dht commands which came after they timed out
+        # (a late reply still pending is harmless, as any peer in the DHT network can be sent the query)
+        self.drain_late_manager_replies()
+
+        # send the command to the manager (server) node to query the DHT network
         # the command is of the form "query-dht <peer_name>" with peer_name being the name of the peer sending the query
         query_dht_command = "query-dht " + self.peer_name
         self.m_port_socket.sendto(query_dht_command.encode('utf-8'), (self.manager_addres, self.manager_port))
 
         # wait for the response from the manager (server) node
         # the response is either of the form "FAILURE: <reason>" or "SUCCESS <a string containing the 3-tuple element (peer_name, peer_ipv4, p_port) which is a random peer in the DHT network>"
-        response, _ = self.m_port_socket.recvfrom(1024)
+        self.m_port_socket.settimeout(timeout)
+        try:
+            response, _ = self.m_port_socket.recvfrom(1024)
+        except socket.timeout:
+            self.late_manager_replies += 1
+            print("The manager (server) node did not reply to query-dht in time.")
+            return None
+        finally:
+            self.m_port_socket.settimeout(None)
         response = response.decode('utf-8')
 
         # if the response is SUCCESS, then we have received the "SUCCESS <a string containing the 3-tuple element (peer_name, peer_ipv4, p_port) which is a random peer in the DHT network>" response
         if response.startswith("SUCCESS"):
             _, peer_in_DHT = response.split("\n",1) # splitting the response to get the peer_in_DHT string
-            peer_in_DHT = ast.literal_eval(peer_in_DHT)
-            peer_in_DHT = (peer_in_DHT[0], peer_in_DHT[1], int(peer_in_DHT[2]))
-        
+            peer_in_DHT = ast.literal_eval(peer_in_DHT)[0] # the manager sends a list containing the single 3-tuple
+            return (peer_in_DHT[0], peer_in_DHT[1], int(peer_in_DHT[2]))
+        # print the response to better understand the reason for failure
+        print(response)
+        return None
+
+    # a method that reads and drops the replies of the manager (server) node to query-dht commands which timed out, if they have arrived
+    def drain_late_manager_replies(self):
+        if self.late_manager_replies == 0:
+            return
+        self.m_port_socket.setblocking(False)
+        try:
+            while self.late_manager_replies > 0:
+                self.m_port_socket.recvfrom(1024)
+                self.late_manager_replies -= 1
+        except BlockingIOError:
+            pass
+        finally:
+            self.m_port_socket.setblocking(True)
+
+    # a method that finds all the records with an event id between lo and hi (inclusive) in the DHT network
+    # every peer is asked in parallel for a page of its records in the range, and the peers which have more records are asked again
+    # from the last event id they returned, so the result is the merge of the sorted streams of records from all the peers
+    # returns the list of records sorted by event id or None if the query failed
+    def find_range(self, lo, hi):
+        # find the peers in the DHT network (a peer in the DHT network already knows them, a free peer asks the manager and then a peer in the DHT network)
+        ring = self.get_ring_view()
+        if ring is None:
+            return None
+        peers_DHT = ring["peers"]
+
+        streams = {peer[0]: [] for peer in peers_DHT} # the pages of records returned by each peer
+        after = {peer[0]: lo - 1 for peer in peers_DHT} # the last event id returned by each peer
+        remaining = list(peers_DHT) # the peers which may still have records in the range
+        while remaining:
+            # each page is a broadcast of its own, so late replies to an earlier page are ignored
+            # a peer which has the shared dictionary asks for the pages to be compressed with it
+            compression = " " + self.dictionary_id if self.dictionary_id is not None else ""
+            acks = self.broadcast("range", lambda peer: "find-range " + str(after[peer[0]] + 1) + " " + str(hi) + compression, targets=remaining)
+            if acks is None:
+                return None
+            for peer_name, payload in acks.items():
+                page = json.loads(payload)
+                if page["records"]:
+                    streams[peer_name].extend(page["records"])
+                    after[peer_name] = int(page["records"][-1][0])
+            remaining = [peer for peer in remaining if json.loads(acks[peer[0]])["more"]]
+
+        # merge the sorted streams of records from all the peers
+        records = list(heapq.merge(*streams.values(), key=lambda event: int(event[0])))
+        print("Found " + str(len(records)) + " storm events with an event id between " + str(lo) + " and " + str(hi) + ".")
+        return records
+
+    # a method that replies to the find-range command with a page of the records in the local hash table in a range of event ids
+    def find_range_page(self, p_data, p_address, p_port):
+        # the p_data is of the form "<ack_type> <lo> <hi> [<dictionary_id>]"
+        ack_type, lo, hi, *compression = p_data.split(" ")
+        lo, hi = int(lo), int(hi)
+
+        with self.event_index_lock:
+            if not self.event_index_sorted:
+                # sort the records appended since the last range query and drop the entries of event ids which were stored more than once
+                self.event_index.sort()
+                self.event_index = [entry for i, entry in enumerate(self.event_index) if i + 1 == len(self.event_index) or self.event_index[i + 1][0] != entry[0]]
+                self.event_index_sorted = True
+            start = bisect.bisect_left(self.event_index, (lo,))
+            end = bisect.bisect_right(self.event_index, (hi, math.inf))
+            entries = self.event_index[start:end]
+
+        # fill the page with records until it is as large as a store batch
+        # the first record is always sent, even if it is larger on its own, so that the querying peer always moves past it
+        records = []
+        size = 0
+        more = False
+        for event_id, pos in entries:
+            event = self.local_hash_table.get(pos)
+            if event is None or int(event[0]) != event_id:
+                continue # the record has been overwritten or deleted since it was indexed
+            size += len(json.dumps(event)) + 2
+            if size > STORE_BATCH_BYTES and records:
+                more = True
+                break
+            records.append(event)
+
+        ack_command = "ack " + ack_type + " " + self.peer_name + " " + json.dumps({"records": records, "more": more})
+        # compress the page if the querying peer has the same dictionary as this peer
+        self.send_command(ack_command, (p_address, p_port), compression == [self.dictionary_id])
+
+    # a method that queries the DHT for a specific event_id record
+    # the query gives up deadline seconds after it started (including the time taken to ask the manager for a peer in the DHT network),
+    # and sends a hedged duplicate of the find-event command hedge_delay seconds after the command was sent
+    # (by default the HEDGE_PERCENTILE of the latencies of the recent find-event commands, pass math.inf to never hedge)
+    # returns the event record or None if it was not found or the query timed out
+    def query_dht(self, event_id=None, deadline=QUERY_DEADLINE, hedge_delay=None):
+        start = time.monotonic()
+        if event_id is None:
+            event_id = self.event_id_set[0]
+
+        # first, check the bloom filters of the peers in the DHT network (if they have been fetched) so a definite miss needs no network traffic
+        if self.is_definite_miss(event_id):
+            print("Storm event " + str(event_id) + " not found in the DHT.")
+            return
+
+        # ask the manager (server) node for a peer in the DHT network to send the query to, waiting no longer than the rest of the deadline
+        peer_in_DHT = self.request_peer_in_DHT(timeout=max(deadline - (time.monotonic() - start), 0.001))
+        if peer_in_DHT is None:
+            return
+
+        # refresh the bloom filters of the peers in the DHT network in the background if they have not been fetched recently
+        # the query does not wait for them, so the filters fetched last time (if any) are used until the new ones arrive
+        if time.monotonic() - self.bloom_filters_fetched_at > BLOOM_REFRESH_INTERVAL:
+            self.refresh_bloom_filters(peer_in_DHT)
+
+        if hedge_delay is None:
+            hedge_delay = self.hedge_delay(deadline=deadline)
+        # find the peer storing the event id, as it is the peer the hedged duplicate is sent to
+        hedge_peer = self.hedge_target(event_id, peer_in_DHT) if hedge_delay < deadline else None
+
+        # the response is matched to the query by its tag, and is received by the p-port thread like every other message
+        # the hedged duplicate is tagged "<tag>h" so that the latency of the first command can still be measured when the duplicate wins
+        with self.query_answered:
+            self.queries += 1
+            tag = str(self.queries)
+            self.query_responses[tag] = None
+            self.expire_queries()
+
         # send the find-event command to the peer_in_DHT
-        # the command is of the form "find-event <event_id> <a string containing the 3-tuple element (peer_name, peer_ipv4, p_port) of the peer sending the query> id-seq"
-        self.listen_p_port = False
-        find_event_command = "find-event " + str(self.event_id_set[0]) + " " + json.dumps((self.peer_name, self.peer_IPv4_address, self.p_port)) + " id-seq"
+        # the command is of the form "find-event <event_id> <a string containing the 4-tuple element (peer_name, peer_ipv4, p_port, tag) of the peer sending the query> id-seq"
+        find_event_command = "find-event " + str(event_id) + " " + json.dumps((self.peer_name, self.peer_IPv4_address, self.p_port, tag), separators=(",", ":")) + " id-seq" # compact json, as the command is split on spaces
+        sent = time.monotonic()
+        with self.query_answered:
+            self.query_started[tag] = (sent, deadline)
         self.p_port_socket.sendto(find_event_command.encode('utf-8'), (peer_in_DHT[1], peer_in_DHT[2]))
 
-        # wait for the response
-        # the response is either of the form "FAILURE" or "SUCCESS <a string containing the event record> <id_seq>"
-        response, _ = self.p_port_socket.recvfrom(1024)
-        response = response.decode('utf-8')
+        # wait for the response until the deadline, and send the hedged duplicate if it has not come back after the hedge delay
+        # whichever response arrives first is used, and the other one is ignored
+        with self.query_answered:
+            while self.query_responses[tag] is None:
+                now = time.monotonic()
+                if now - start >= deadline:
+                    break
+                if hedge_peer is not None and now - sent >= hedge_delay:
+                    hedge_command = find_event_command.replace('"' + tag + '"]', '"' + tag + 'h"]', 1)
+                    self.p_port_socket.sendto(hedge_command.encode('utf-8'), (hedge_peer[1], hedge_peer[2]))
+                    hedge_peer = None
+                    self.hedges += 1
+                    continue
+                wake_at = start + deadline if hedge_peer is None else min(start + deadline, sent + hedge_delay)
+                self.query_answered.wait(wake_at - now)
+            response = self.query_responses.pop(tag)
 
-        # if the response is FAILURE, then the query failed
-        if response == "FAILURE":
-            print("Storm event " + str(self.event_id_set[0]) + " not found in the DHT.")
-        else:
-            _, event_record_id_seq = response.split("\n",1) # splitting the response to get the event record and id_seq
-            event_record, id_seq = event_record_id_seq.split(" ",1) # splitting the event record and id_seq
-            event_record = json.loads(event_record) # converting the event record to a dictionary
-            print("Storm event " + str(self.event_id_set[0]) + " found in the DHT.")
-            print("The event record is: " + str(event_record))
-            print("The id_seq is: " + id_seq)
+        if response is None:
+            print("Query for storm event " + str(event_id) + " timed out after " + str(deadline) + " seconds.")
+            return None
+
+        # the response is either of the form ("FAILURE", "") or ("SUCCESS", "<a string containing the event record> <id_seq>")
+        return_code, event_record_id_seq = response
+        if return_code == "FAILURE":
+            print("Storm event " + str(event_id) + " not found in the DHT.")
+            return None
+        event_record, id_seq = event_record_id_seq.rsplit(" ",1) # splitting the event record and id_seq (the event record contains spaces)
+        event_record = json.loads(event_record) # converting the event record to a dictionary
+        print("Storm event " + str(event_id) + " found in the DHT.")
+        print("The event record is: " + str(event_record))
+        print("The id_seq is: " + id_seq)
+        return event_record
+
+    # the method that records the response to a query sent by this peer and wakes up the query
+    def receive_query_response(self, return_code, p_data):
+        # the p_data is of the form "<tag>" for a FAILURE or "<tag>\n<event record> <id_seq>" for a SUCCESS
+        tag, _, event_record_id_seq = p_data.partition("\n")
+        with self.query_answered:
+            # record the latency of the find-event command, even if its hedged duplicate has already answered the query
+            started = self.query_started.pop(tag, None)
+            if started is not None:
+                self.query_latencies.append(time.monotonic() - started[0])
+            tag = tag.rstrip("h") # the hedged duplicate answers the same query
+            # ignore the responses to queries which have already been answered (the slower of a hedged pair) or have timed out
+            if self.query_responses.get(tag, "") is None:
+                self.query_responses[tag] = (return_code, event_record_id_seq)
+                self.query_answered.notify_all()
+
+    # a method that forgets the find-event commands which got no response before their deadline, counting the deadline as their latency
+    # (called with the query_answered lock held)
+    def expire_queries(self):
+        now = time.monotonic()
+        for tag, (start, deadline) in list(self.query_started.items()):
+            if now - start > deadline:
+                del self.query_started[tag]
+                self.query_latencies.append(deadline)
+
+    # a method that returns the number of seconds after which a query sends a hedged duplicate
+    # this is the given percentile of the latencies of the recent find-event commands, but no more than half the deadline so the duplicate has time to be answered
+    def hedge_delay(self, percentile=HEDGE_PERCENTILE, deadline=QUERY_DEADLINE):
+        latencies = sorted(self.query_latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY
+        return min(deadline / 2, latencies[min(len(latencies) - 1, int(percentile / 100 * len(latencies)))])
 
-        self.listen_p_port = True # continue listening for messages from the peer nodes            
+    # a method that chooses the peer a hedged duplicate of the find-event command for the event id is sent to
+    # this is the peer storing the event id, which answers without forwarding, unless the first command was sent to it, in which case another peer is chosen
+    # a client only uses the ring view it already has (it is fetched along with the bloom filters), so that choosing the peer never waits for the network
+    def hedge_target(self, event_id, peer_in_DHT):
+        ring = self.get_ring_view() if self.id is not None else self.ring_view
+        if ring is None:
+            return None
+        peers = [tuple(peer) for peer in ring["peers"]]
+        if ring["table_size"] is not None and ring["slots"] is not None:
+            owner = peers[owner_of(event_id % ring["table_size"], ring["slots"], len(peers))]
+            if owner[0] != peer_in_DHT[0]:
+                return owner
+        others = [peer for peer in peers if peer[0] != peer_in_DHT[0]]
+        return random.choice(others) if others else None
 
     def find_event(self, p_data):
+        self.find_events += 1
+        # wait for the injected delay first, if any, as a slow or paused peer would
+        if self.injected_delay and random.random() < self.injected_delay_ratio:
+            if self.injected_delay == math.inf:
+                return
+            time.sleep(self.injected_delay)
         # split the p_data into three variables
         p_data = p_data.split(" ",2)
         event_id = int(p_data[0])
+        # the peer sending the query may add a 4th element, a tag which is echoed in the response so that it can tell the responses to many queries apart
         peer_sending_query = json.loads(p_data[1])
-        peer_sending_query = (peer_sending_query[0], peer_sending_query[1], int(peer_sending_query[2]))
+        peer_sending_query = (peer_sending_query[0], peer_sending_query[1], int(peer_sending_query[2])) + tuple(peer_sending_query[3:])
         id_seq = p_data[2]
         I = [x for x in range(0, self.ring_size)] # the list of identifiers of the peers in the DHT network
         if id_seq == "id-seq":
             id_seq = ""
         else:
-            visited = [int(x) for x in id_seq.split(",").strip()] # the list of identifiers of the peers that have been visited to find the event_id
+            visited = [int(x) for x in id_seq.strip(",").split(",")] # the list of identifiers of the peers that have been visited to find the event_id
             I = [x for x in I if x not in visited] # remove the visited identifiers from the list of identifiers to still be visted
 
         # compute the pos and id
-        s = self.next_prime(2 * len(self.local_hash_table))
-        pos = event_id % s
-        id = pos % self.ring_size
+        pos = event_id % self.table_size
+        id = owner_of(pos, self.slots, self.ring_size)
 
         # check if the id is the same as the current peer
         if id == self.id:
-            # check if the event_id is in the local hash table
-            if pos in self.local_hash_table:
+            # check if the event_id is in the local hash table (a different event id may be stored at the same position)
+            if pos in self.local_hash_table and int(self.local_hash_table[pos][0]) == event_id:
                 # send the response to the peer_sending_query
                 id_seq += str(self.id)
-                response = "SUCCESS\n" + json.dumps(self.local_hash_table[pos]) + " " + id_seq
-                self.p_port_socket.sendto(response.encode('utf-8'), (peer_sending_query[1], peer_sending_query[2]))
+                self.answer_query(peer_sending_query, "SUCCESS", json.dumps(self.local_hash_table[pos]) + " " + id_seq)
                 return
             else: # if the event_id is not in the local hash table
                 # send the response to the peer_sending_query
-                self.p_port_socket.sendto("FAILURE".encode('utf-8'), (peer_sending_query[1], peer_sending_query[2]))
+                self.answer_query(peer_sending_query, "FAILURE")
                 return
         else: # if the id is not the same as the current peer
+            # answer the query from the hot key cache if the record of the event id is cached
+            event, hot = self.hot_keys.lookup(event_id)
+            if event is not None:
+                id_seq += str(self.id)
+                self.answer_query(peer_sending_query, "SUCCESS", json.dumps(event) + " " + id_seq)
+                return
+            if hot:
+                # the event id has just become hot, so ask its owner for the record to cache for the next lookups
+                owner = self.peers_DHT[id]
+                self.p_port_socket.sendto(("cache-fill " + str(event_id)).encode('utf-8'), (owner[1], owner[2]))
             # update the I to remove the id of the current peer as it has been visited
             I = [x for x in I if x != self.id]
             # if I is empty, then query failed
             if len(I) == 0:
                 # send the response to the peer_sending_query
-                self.p_port_socket.sendto("FAILURE".encode('utf-8'), (peer_sending_query[1], peer_sending_query[2]))
+                self.answer_query(peer_sending_query, "FAILURE")
                 return
             # update id_seq to include the id of the current peer as it has been visited
             id_seq += str(self.id) + ","
@@ -357,9 +1564,25 @@ class DHT_peer:
             # find the peer with the next id
             next_peer = self.peers_DHT[next]
             # send the find-event command to the next_peer
-            find_event_command = "find-event " + str(event_id) + " " + str(peer_sending_query) + " " + id_seq
+            find_event_command = "find-event " + str(event_id) + " " + json.dumps(peer_sending_query, separators=(",", ":")) + " " + id_seq
             self.p_port_socket.sendto(find_event_command.encode('utf-8'), (next_peer[1], next_peer[2]))
     
+    # a method that sends the response to a find-event command to the peer sending the query
+    # the response is of the form "SUCCESS[ <tag>]\n<event record> <id_seq>" or "FAILURE[ <tag>]", with the tag only if the query carried one
+    def answer_query(self, peer_sending_query, return_code, body=None):
+        if len(peer_sending_query) > 3:
+            return_code += " " + str(peer_sending_query[3])
+        response = return_code if body is None else return_code + "\n" + body
+        self.p_port_socket.sendto(response.encode('utf-8'), (peer_sending_query[1], peer_sending_query[2]))
+
+    # a method that replies to the cache-fill command with the record of the event id (nothing is sent if the record is not stored)
+    def send_cache_record(self, p_data, p_address, p_port):
+        event_id = int(p_data)
+        event = self.local_hash_table.get(event_id % self.table_size)
+        if event is not None and int(event[0]) == event_id:
+            cache_record_command = "cache-record " + json.dumps(event)
+            self.p_port_socket.sendto(cache_record_command.encode('utf-8'), (p_address, p_port))
+
     # the method the initiates the leave-dht process for the peer
     def leave_dht(self):
         # first, send the command to the manager (server) node to leave the DHT network
@@ -415,10 +1638,10 @@ class DHT_peer:
             self.normal_teardown()
         else:
             # if the id is not 0, then it is the case that a peer initiated the leave-dht process
-            # first, initiate a teardown by sending the teardown command to the right neighbour of the peer in the DHT network
-            self.teardown_complete = True
-            teardown_command = "teardown"
-            self.p_port_socket.sendto(teardown_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
+            # first, tear down the local hash tables of all the peers in parallel and wait until all of them have acknowledged it
+            self.clear_local_hash_table()
+            if self.broadcast("teardown", lambda peer: "teardown") is None:
+                return
 
             #initiate the renumbering process of the peers in the DHT network by sending reset-id command to the right neighbour of the peer
             # the command is of the form "reset-id <id which the right neighbour of the peer should use> <ring_size to be used by the right neighbour of the peer> <the id of leaving peer so as to remove it from the list of peers in the DHT network>"
@@ -443,33 +1666,33 @@ class DHT_peer:
             print(response)
             return
         
-        # delete the local hash table of the peer and set the teardown_complete flag to True
-        self.local_hash_table = {}
-        self.teardown_complete = True
-        
-        # send the teardown command to the right neighbour of the peer in the DHT network
-        teardown_command = "teardown"
-        self.p_port_socket.sendto(teardown_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
-    
-    # the method that deletes the local hash table of the peer
-    def delete_local_hash_table(self):
         # delete the local hash table of the peer
-        self.local_hash_table = {}
-        
-        # check if the all the peers have completed the teardown process by checking the if the teardown_complete flag is True
-        if self.teardown_complete and self.id == 0 and not self.leaving_or_joining:
-            # send the teardown-complete command to the manager (server) node
-            teardown_complete_command = "teardown-complete " + self.peer_name
-            self.m_port_socket.sendto(teardown_complete_command.encode('utf-8'), (self.manager_addres, self.manager_port))
-        elif self.teardown_complete and self.id == 0 and self.leaving_or_joining:
-            return
-        elif self.teardown_complete and self.id != 0:
-            # this case happens when the teardown initiated is due to the leave-dht process
+        self.clear_local_hash_table()
+
+        # send the teardown command to all the peers in the DHT network in parallel and wait until all of them have acknowledged it
+        if self.broadcast("teardown", lambda peer: "teardown") is None:
             return
-        else:
-            # send the teardown command to the right neighbour of the peer in the DHT network
-            teardown_command = "teardown"
-            self.p_port_socket.sendto(teardown_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
+
+        # all the peers have deleted their local hash tables, so send the teardown-complete command to the manager (server) node
+        teardown_complete_command = "teardown-complete " + self.peer_name
+        self.m_port_socket.sendto(teardown_complete_command.encode('utf-8'), (self.manager_addres, self.manager_port))
+
+        # wait for the response from the manager (server) node
+        # the response is either of the form "FAILURE: <reason>" or "SUCCESS: Teardown complete"
+        response, _ = self.m_port_socket.recvfrom(1024)
+        response = response.decode('utf-8')
+        print(response)
+        if response.startswith("SUCCESS"):
+            print("teardown-complete")
+    
+    # the method that deletes the local hash table of the peer and acknowledges it to the peer which initiated the teardown
+    def delete_local_hash_table(self, ack_type, p_address, p_port):
+        # delete the local hash table of the peer
+        self.clear_local_hash_table()
+
+        # acknowledge the teardown to the peer which sent the teardown command
+        ack_command = "ack " + ack_type + " " + self.peer_name
+        self.p_port_socket.sendto(ack_command.encode('utf-8'), (p_address, p_port))
     
     # the method that resets the identifier of the peer in the DHT network
     def reset_id(self, p_data, p_address, p_port):
@@ -489,6 +1712,8 @@ class DHT_peer:
         # update the id of the current peer
         self.id = id
         self.ring_size = ring_size
+        self.configured_ring = None # the ring has changed since the last set_id
+        self.slots = None # the virtual positions are sent again when the new leader populates
 
         # remove the leaving_peer from the list of peers in the DHT network by checking the peer IP address and port number
         self.peers_DHT = [peer for peer in self.peers_DHT if peer[1] != p_address and peer[2] != p_port]
@@ -513,27 +1738,134 @@ class DHT_peer:
         self.ring_size += 1
         # find the new right neighbour of the peer
         self.right_neighbour = self.peers_DHT[(self.id+1)%self.ring_size]
-        self.local_hash_table = {} # the local hash table of the peer
+        self.clear_local_hash_table()
 
-        # send the set_id command to the new right neighbour of the peer
-        set_id_command = "set_id " + str(self.id+1) + " " + str(self.ring_size) + " " + json.dumps(self.peers_DHT)
-        self.p_port_socket.sendto(set_id_command.encode('utf-8'), (self.right_neighbour[1], self.right_neighbour[2]))
-
-        # while the peer is not ready to populate the local hash table, keep waiting
-        while not self.can_populate:
-            pass
+        # send every peer its new identifier and the new ring view in parallel and wait until all of them have acknowledged it
+        if not self.configure_ring():
+            return
 
         # populate the local hash table of the peer
-        self.populate_dht()
+        if not self.populate_dht():
+            print("Rebuilding the DHT failed, as some peers did not acknowledge the populating.")
+            return
 
         # send the rebuild-dht command to the joining peer as confirmation of the completion of the rebuilding and joining process
         rebuild_dht_command = "rebuild-dht"
         self.p_port_socket.sendto(rebuild_dht_command.encode('utf-8'), (joining_peer[1], joining_peer[2]))
 
         return
-   
+
+# The DHT_host class runs many peers in a single process, which makes it cheap to start a large ring on one machine
+# the peers are registered with the manager with a register-batch command and a single thread listens on the p-ports of all of them
+class DHT_host:
+    # the constructor which creates the peers, registers them and starts listening
+    # peers is a list of tuples (peer_name, peer_IPv4_address, m_port, p_port) with the number of virtual nodes of the peer as an optional fifth element
+    def __init__(self, manager_addres, manager_port, peers):
+        self.manager_addres = manager_addres # the address of the manager (server) node
+        self.manager_port = manager_port # the port of the manager (server) node
+        self.peers = [DHT_peer(manager_addres, manager_port, *peer[:4], standalone=False, virtual_nodes=peer[4] if len(peer) > 4 else VIRTUAL_NODES) for peer in peers] # the peers run by the host
+        self.register_with_manager()
+
+        # the selector over the p-ports of all the registered peers (each socket carries the peer it belongs to)
+        self.selector = selectors.DefaultSelector()
+        for peer in self.peers:
+            self.selector.register(peer.p_port_socket, selectors.EVENT_READ, peer)
+
+        # the thread for receiving messages from the peer nodes on all the p-ports
+        self.p_port_thread = threading.Thread(target=self.receive_p_ports)
+        self.p_port_thread.start()
+
+    # the method that registers all the peers with the manager (server) node through the m-port of the first peer
+    # the peers are split into as many register-batch commands as needed to fit each command in a datagram
+    def register_with_manager(self):
+        registered = set()
+        command = "register-batch"
+        for peer in self.peers:
+            entry = " " + peer.peer_name + " " + peer.peer_IPv4_address + " " + str(peer.m_port) + " " + str(peer.p_port)
+            if len(command) + len(entry) > BUFFER_SIZE:
+                registered |= self.send_register_batch(command)
+                command = "register-batch"
+            command += entry
+        registered |= self.send_register_batch(command)
+
+        # close the sockets of the peers the manager refused and stop running them
+        for peer in self.peers:
+            if peer.peer_name not in registered:
+                peer.m_port_socket.close()
+                peer.p_port_socket.close()
+        self.peers = [peer for peer in self.peers if peer.peer_name in registered]
+        print(str(len(self.peers)) + " peers registered successfully with the manager (server) node.")
+
+    # the method that sends a register-batch command and returns the names of the peers that were registered
+    def send_register_batch(self, command):
+        m_port_socket = self.peers[0].m_port_socket
+        m_port_socket.sendto(command.encode('utf-8'), (self.manager_addres, self.manager_port))
+
+        # wait for the response from the manager (server) node
+        # the response has one line for each peer of the form "<peer_name> SUCCESS" or "<peer_name> FAILURE: <reason>"
+        response, _ = m_port_socket.recvfrom(BUFFER_SIZE)
+        registered = set()
+        for line in response.decode('utf-8').split("\n"):
+            peer_name, returncode = line.split(" ", 1)
+            if returncode == "SUCCESS":
+                registered.add(peer_name)
+            else:
+                # print the response to better understand the reason for failure
+                print(line)
+        return registered
+
+    # the method that listens for the messages from the peer nodes on the p-ports of all the peers
+    def receive_p_ports(self):
+        while True:
+            for key, _ in self.selector.select():
+                peer = key.data
+                p_data, p_address = peer.p_port_socket.recvfrom(BUFFER_SIZE)
+                peer.handle_p_message(p_data, p_address)
+
+# a function that reads the peers run by a host from a file with one line of the form "<peer_name> <IPv4_address> <m_port> <p_port> [<virtual_nodes>]" for each peer
+def read_host_config(path):
+    peers = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split("#", 1)[0].split() # ignore comments and blank lines
+            if line:
+                peers.append((line[0], line[1], int(line[2]), int(line[3]), int(line[4]) if len(line) > 4 else VIRTUAL_NODES))
+    return peers
+
+# the main method of the host mode, used when the peers are given on the command line instead of being entered one at a time
+if __name__ == "__main__" and len(sys.argv) > 1:
+    parser = argparse.ArgumentParser(description="Run many DHT peers in a single process.")
+    parser.add_argument("--manager", nargs=2, metavar=("ADDRESS", "PORT"), required=True, help="the address and port of the manager (server) node")
+    parser.add_argument("--config", help="a file with one line of the form '<peer_name> <IPv4_address> <m_port> <p_port> [<virtual_nodes>]' for each peer")
+    parser.add_argument("--peers", type=int, help="the number of peers to run (instead of --config)")
+    parser.add_argument("--ip", default="127.0.0.1", help="the IPv4 address of the peers (with --peers)")
+    parser.add_argument("--base-port", type=int, default=42001, help="the first port used by the peers, each peer uses the next two ports for its m-port and p-port (with --peers)")
+    parser.add_argument("--name-prefix", default="peer", help="the prefix of the names of the peers, followed by their number (with --peers)")
+    parser.add_argument("--virtual-nodes", type=int, default=VIRTUAL_NODES, help="the number of virtual nodes of each peer (with --peers)")
+    parser.add_argument("--setup-dht", type=int, metavar="SIZE", help="have the first peer set up a DHT network of this size")
+    parser.add_argument("--year", type=int, default=1996, help="the year of the storm events data used by --setup-dht")
+    parser.add_argument("--inject-delay", nargs=3, action="append", default=[], metavar=("PEER", "SECONDS", "RATIO"), help="delay this ratio of the find-event commands handled by a peer (PEER may be * for all the peers, SECONDS may be inf for a paused peer), can be repeated")
+    args = parser.parse_args()
+
+    if args.config is not None:
+        peers = read_host_config(args.config)
+    elif args.peers is not None:
+        peers = [(args.name_prefix + str(i), args.ip, args.base_port + 2 * i, args.base_port + 2 * i + 1, args.virtual_nodes) for i in range(args.peers)]
+    else:
+        parser.error("either --config or --peers is required")
+
+    start = time.perf_counter()
+    host = DHT_host(args.manager[0], int(args.manager[1]), peers)
+    print("Started " + str(len(host.peers)) + " peers in " + str(round(time.perf_counter() - start, 3)) + " seconds.")
+    for peer_name, seconds, ratio in args.inject_delay:
+        for peer in host.peers:
+            if peer_name in ("*", peer.peer_name):
+                peer.injected_delay, peer.injected_delay_ratio = float(seconds), float(ratio)
+    if args.setup_dht is not None:
+        host.peers[0].setup_dht(args.setup_dht, args.year)
+
 # the main method
-if __name__ == "__main__":
+elif __name__ == "__main__":
     # ask the user to enter the manager address, manager_port, peer_name, peer_IPv4_address, m_port, p_port
     manager_addres = input("Enter the address of the manager (server) node: ")
     manager_port = int(input("Enter the port of the manager (server) node: "))
@@ -0,0 +1,5 @@
+# the modules of the project are in the directory above the tests, so it is added to the path the tests import from
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,39 @@
+# the unit tests of the report of DHT_loadgen.py, which do not need a running DHT network
+import math
+
+from DHT_loadgen import DHT_loadgen, percentile
+
+
+# a load generator with the given results and no socket, as report only reads the results
+def loadgen_with_results(results):
+    loadgen = DHT_loadgen.__new__(DHT_loadgen)
+    loadgen.results = results
+    loadgen.timeout = 1.0
+    return loadgen
+
+
+# the percentile of a sorted list is the nearest rank, and None for no latencies
+def test_percentile_nearest_rank():
+    latencies = [i / 100 for i in range(1, 101)]
+    assert percentile(latencies, 50) == 0.5
+    assert percentile(latencies, 99) == 0.99
+    assert percentile(latencies, 100) == 1.0
+    assert percentile([], 50) is None
+
+
+# the queries which timed out count in the percentiles, so losing the slowest queries does not make them look better
+def test_report_counts_timed_out_queries():
+    results = [(i, i, i + 0.25, True) for i in range(95)]
+    report = loadgen_with_results(results).report(100, 100, 0, 95, 0)
+    assert report["answered"] == 95 and report["timed_out"] == 5
+    assert report["latency"]["50"] == report["service_latency"]["50"] == 0.25
+    assert report["latency"]["99"] == report["service_latency"]["99"] == math.inf
+    assert report["latency"]["max"] == math.inf
+
+
+# the corrected latency is measured from the time a query was meant to be sent, the uncorrected one from the time it was sent
+def test_report_corrects_for_sender_lag():
+    results = [(i, i + 0.5, i + 0.501, True) for i in range(10)]
+    report = loadgen_with_results(results).report(10, 10, 0, 10, 0.5)
+    assert math.isclose(report["latency"]["50"], 0.501)
+    assert math.isclose(report["service_latency"]["50"], 0.001)
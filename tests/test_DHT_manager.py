@@ -0,0 +1,77 @@
+# the unit tests of the journal and the snapshots of DHT_manager.py, which do not need the manager socket
+import json
+
+import DHT_manager
+from DHT_manager import DHT_manager as Manager
+
+
+# a manager persisting its state to the journal and snapshot files in the given directory (the socket is only opened by start)
+def manager_in(directory):
+    return Manager("127.0.0.1", 0, str(directory / "DHT_manager.journal"), str(directory / "DHT_manager.snapshot"))
+
+
+# the journal records in the journal file of the given directory
+def journal_records(directory):
+    with open(directory / "DHT_manager.journal") as file:
+        return [json.loads(line) for line in file]
+
+
+# registers the peers p0 ... p<count - 1> and waits until the registrations are durable
+def register_peers(manager, count):
+    for i in range(count):
+        manager.register_peer("p" + str(i), ["127.0.0.1", 2 * i, 2 * i + 1, "Free"])
+    manager.sync_journal()
+
+
+# the state is rebuilt from the last snapshot and the records journaled after it
+def test_recover_replays_the_journal_on_top_of_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(DHT_manager, "SNAPSHOT_EVERY", 50)
+    manager = manager_in(tmp_path)
+    register_peers(manager, 120)
+    manager.set_peer_state("p3", "Leader")
+    manager.deregister_peer("p7")
+    manager.set_flags(dht_exists=True)
+    manager.sync_journal()
+    assert (tmp_path / "DHT_manager.snapshot").exists()
+    assert len(journal_records(tmp_path)) < 123 # the journal was emptied by the snapshots
+
+    recovered = manager_in(tmp_path)
+    assert recovered.peers_dict == manager.peers_dict
+    assert len(recovered.peers_dict) == 119 and recovered.peers_dict["p3"][3] == "Leader"
+    assert recovered.dht_exists
+    assert recovered.journal_seq == manager.journal_seq == 123
+
+
+# the records which are already part of the snapshot (a crash between writing the snapshot and emptying the journal) are not applied again
+def test_recover_skips_the_records_in_the_snapshot(tmp_path):
+    state = {"seq": 2, "peers_dict": {"p1": ["127.0.0.1", 3, 4, "Free"]}, "flags": {"dht_exists": False}}
+    (tmp_path / "DHT_manager.snapshot").write_text(json.dumps(state))
+    records = [
+        [1, "register", "p0", ["127.0.0.1", 1, 2, "Free"]],
+        [2, "deregister", "p0"],
+        [2, "register", "p1", ["127.0.0.1", 3, 4, "Free"]],
+        [3, "state", "p1", "Leader"],
+        [4, "register", "p2", ["127.0.0.1", 5, 6, "Free"]],
+    ]
+    (tmp_path / "DHT_manager.journal").write_text("".join(json.dumps(record) + "\n" for record in records))
+    recovered = manager_in(tmp_path)
+    assert recovered.peers_dict == {"p1": ["127.0.0.1", 3, 4, "Leader"], "p2": ["127.0.0.1", 5, 6, "Free"]}
+    assert recovered.journal_seq == 4
+    assert recovered.journal_records == 2
+
+
+# a record torn by a crash is cut off, so the records journaled after recovering are not appended to it
+def test_recover_cuts_a_torn_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(DHT_manager, "SNAPSHOT_EVERY", 50)
+    manager = manager_in(tmp_path)
+    register_peers(manager, 120)
+    with open(tmp_path / "DHT_manager.journal", "a") as file:
+        file.write('[121, "register", "p120", ["127.0')
+    recovered = manager_in(tmp_path)
+    assert len(recovered.peers_dict) == 120 and recovered.journal_seq == 120
+    assert (tmp_path / "DHT_manager.journal").read_bytes().endswith(b"\n") or not (tmp_path / "DHT_manager.journal").read_bytes()
+
+    recovered.register_peer("p120", ["127.0.0.1", 240, 241, "Free"])
+    recovered.sync_journal()
+    assert journal_records(tmp_path)[-1] == [121, "register", "p120", ["127.0.0.1", 240, 241, "Free"]]
+    assert len(manager_in(tmp_path).peers_dict) == 121
@@ -0,0 +1,283 @@
+# the unit tests of the helpers of DHT_peer.py which do not need a running DHT network
+import csv
+import json
+import os
+import socket
+import zlib
+
+import pytest
+
+import DHT_peer
+from DHT_peer import (BloomFilter, HotKeyCache, WriteBuffer, assign_virtual_nodes, compress_command, count_csv_range,
+                      owner_of, read_csv_range, shard_csv_range, split_csv, train_dictionary)
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DATA_FILES = [os.path.join(DATA_DIRECTORY, name) for name in ("details-1950.csv", "details-1996.csv")]
+
+
+# the number of rows of a csv file (without the header) as read by the csv module
+def count_rows(path):
+    with open(path, newline='') as file:
+        return sum(1 for row in csv.reader(file) if row) - 1
+
+
+# a bloom filter has no false negatives, and about the false positive rate it was sized for once it is full
+def test_bloom_filter_no_false_negatives():
+    bloom_filter = BloomFilter(4096, 0.01)
+    for event_id in range(4096):
+        bloom_filter.add(event_id * 7)
+    assert all(bloom_filter.might_contain(event_id * 7) for event_id in range(4096))
+    false_positives = sum(bloom_filter.might_contain(event_id) for event_id in range(10 ** 6, 10 ** 6 + 10000))
+    assert false_positives < 300
+
+
+# a filter sent in parts is rebuilt with the same bits, and every part fits in one datagram
+@pytest.mark.parametrize("part_bytes", [DHT_peer.BLOOM_PART_BYTES, 1000])
+def test_bloom_filter_round_trip(monkeypatch, part_bytes):
+    monkeypatch.setattr(DHT_peer, "BLOOM_PART_BYTES", part_bytes)
+    bloom_filter = BloomFilter(32768, 0.01)
+    for event_id in range(32768):
+        bloom_filter.add(event_id)
+    parts = [bloom_filter.to_json(part) for part in range(bloom_filter.parts())]
+    assert all(len(part) + 100 < DHT_peer.BUFFER_SIZE for part in parts)
+    decoded = BloomFilter.from_json(parts)
+    assert decoded.bits == bloom_filter.bits
+    assert decoded.count == bloom_filter.count
+    assert all(decoded.might_contain(event_id) for event_id in range(32768))
+
+
+# the parts of a filter are rejected if one is missing or they come from filters of different sizes
+def test_bloom_filter_rejects_mismatched_parts(monkeypatch):
+    monkeypatch.setattr(DHT_peer, "BLOOM_PART_BYTES", 1000)
+    small, large = BloomFilter(2048, 0.01), BloomFilter(4096, 0.01)
+    assert small.parts() > 1
+    assert BloomFilter.from_json([small.to_json(0)]) is None
+    assert BloomFilter.from_json([small.to_json(0)] + [large.to_json(part) for part in range(1, small.parts())]) is None
+
+
+# the chunks of the csv file follow each other, and together hold every row exactly once
+@pytest.mark.parametrize("path", DATA_FILES)
+@pytest.mark.parametrize("chunk_bytes", [4096, 1024 * 1024])
+def test_split_csv_covers_every_row(path, chunk_bytes):
+    chunks = list(split_csv(path, chunk_bytes))
+    assert all(end == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+    assert chunks[-1][1] == os.path.getsize(path)
+    assert sum(count_csv_range(path, start, end) for start, end in chunks) == count_rows(path)
+    assert sum(len(read_csv_range(path, start, end)) for start, end in chunks) == count_rows(path)
+
+
+# the batches of each chunk hold every row once, at its position in the hash table and for the peer owning it
+@pytest.mark.parametrize("path", DATA_FILES)
+def test_shard_csv_range_places_every_row(path):
+    s, ring_size = 100003, 5
+    slots = assign_virtual_nodes([DHT_peer.VIRTUAL_NODES] * ring_size)
+    records = 0
+    for start, end in split_csv(path, 256 * 1024):
+        for id, payloads in shard_csv_range(path, start, end, s, slots, ring_size).items():
+            for payload in payloads:
+                assert len(payload) <= DHT_peer.STORE_BATCH_BYTES
+                for pos, event in json.loads(payload):
+                    assert pos == int(event[0]) % s
+                    assert owner_of(pos, slots, ring_size) == id
+                    records += 1
+    assert records == count_rows(path)
+
+
+# with the same number of virtual nodes for every peer, the records are placed as without virtual nodes (pos % n)
+@pytest.mark.parametrize("ring_size", [1, 3, 5, 8])
+def test_equal_virtual_nodes_match_modulo(ring_size):
+    slots = assign_virtual_nodes([DHT_peer.VIRTUAL_NODES] * ring_size)
+    assert all(owner_of(pos, slots, ring_size) == pos % ring_size for pos in range(10000))
+    assert all(owner_of(pos, None, ring_size) == pos % ring_size for pos in range(100))
+
+
+# each peer owns a share of the virtual positions in proportion to its number of virtual nodes
+def test_virtual_nodes_are_proportional():
+    slots = assign_virtual_nodes([4, 8, 12])
+    assert [slots.count(id) for id in range(3)] == [4, 8, 12]
+    assert assign_virtual_nodes([4, 8, 12]) == slots
+
+
+# a batch compressed with the shared dictionary is smaller and decompresses to the same bytes with that dictionary
+def test_compress_command_round_trip():
+    path = DATA_FILES[1]
+    chunks = list(split_csv(path, 64 * 1024))
+    dictionary = train_dictionary(read_csv_range(path, *chunks[0]))
+    assert 0 < len(dictionary) <= DHT_peer.COMPRESSION_DICTIONARY_BYTES
+    command = ("store-batch store-1 " + json.dumps([[0, row] for row in read_csv_range(path, *chunks[1])])).encode('utf-8')
+    compressed = compress_command(command, dictionary, "abc")
+    assert compressed is not None and len(compressed) < len(command)
+    _, dictionary_id, data = compressed.split(b" ", 2)
+    assert dictionary_id == b"abc"
+    decompressor = zlib.decompressobj(zdict=dictionary)
+    assert decompressor.decompress(data) + decompressor.flush() == command
+    # a command which compressing does not make smaller is sent as it is
+    assert compress_command(b"ack", dictionary, "abc") is None
+
+
+# an event id becomes hot after threshold lookups, its record is asked for once, and the cache is emptied at the start of each epoch
+def test_hot_key_cache():
+    cache = HotKeyCache(threshold=3, epoch_length=60)
+    event = ["5536849", "TEXAS"]
+    assert cache.lookup(5536849) == (None, False)
+    assert cache.lookup(5536849) == (None, False)
+    assert cache.lookup(5536849) == (None, True)
+    assert cache.lookup(5536849) == (None, False) # the record has already been asked for
+    cache.put(1234, ["1234"]) # not asked for, so not cached
+    cache.put(5536849, event)
+    assert cache.lookup(5536849) == (event, False)
+    assert cache.lookup(1234) == (None, False)
+    assert cache.hits == 1
+    # in the next epoch the record is gone, and the event id (still hot after the counts are halved) is asked for again
+    cache.epoch_length = 0
+    assert cache.lookup(5536849) == (None, True)
+    assert cache.epoch == 1
+
+
+# a fake peer for the write buffer, with a ring of two peers and a broadcast which records the commands and applies no writes
+# the peers in silent do not acknowledge, as if the broadcast had timed out
+class FakePeer:
+    def __init__(self):
+        self.peers = [("p0", "127.0.0.1", 1), ("p1", "127.0.0.1", 2)]
+        self.commands = {}
+        self.written = []
+        self.silent = set()
+
+    def get_ring_view(self):
+        return {"peers": self.peers, "table_size": 11, "slots": None}
+
+    def broadcast(self, ack_type, build_command, targets=None, partial=False):
+        self.commands = {peer[0]: build_command(peer) for peer in targets}
+        acks = {peer_name: json.dumps({"applied": len(json.loads(command.split(" ", 1)[1])), "missing": 0, "collision": 0, "forwarded": 0})
+                for peer_name, command in self.commands.items() if peer_name not in self.silent}
+        return acks if partial or len(acks) == len(targets) else None
+
+    def add_written_event_ids(self, written):
+        self.written += written
+
+
+# the writes to the same event id are coalesced (the latest wins, but an update of a buffered put is still a put) and sent once per peer
+def test_write_buffer_coalesces_writes():
+    peer = FakePeer()
+    write_buffer = WriteBuffer(peer, max_delay=60)
+    assert write_buffer.add("put", 22, ["22", "old"])
+    assert write_buffer.add("update", 22, ["22", "new"])
+    assert write_buffer.add("update", 33, ["33", "x"])
+    assert write_buffer.add("put", 23, ["23", "y"])
+    assert write_buffer.add("delete", 23)
+    assert write_buffer.flush()
+    # 22 and 33 are stored by p0 (pos % 2 == 0) and 23 by p1
+    assert json.loads(peer.commands["p0"].split(" ", 1)[1]) == [["put", 22, ["22", "new"]], ["update", 33, ["33", "x"]]]
+    assert json.loads(peer.commands["p1"].split(" ", 1)[1]) == [["delete", 23, None]]
+    assert write_buffer.results["applied"] == 3
+    assert sorted(peer.written) == [("p0", 22), ("p0", 33)]
+    assert write_buffer.pending == {}
+    assert write_buffer.flush() # nothing left to send
+
+
+# the writes a peer did not acknowledge are put back in the buffer under the writes buffered since, and sent again by the next flush
+def test_write_buffer_keeps_unacknowledged_writes():
+    peer = FakePeer()
+    peer.silent = {"p1"}
+    write_buffer = WriteBuffer(peer, max_delay=60)
+    write_buffer.add("put", 22, ["22", "a"])
+    write_buffer.add("put", 23, ["23", "b"])
+    write_buffer.add("put", 25, ["25", "c"])
+    assert not write_buffer.flush()
+    assert write_buffer.unacknowledged == 2
+    assert write_buffer.results["applied"] == 1 # the write acknowledged by p0 is counted
+    assert sorted(peer.written) == [("p0", 22)]
+    write_buffer.add("update", 23, ["23", "new"])
+    peer.silent = set()
+    assert write_buffer.flush()
+    assert write_buffer.unacknowledged == 0
+    assert json.loads(peer.commands["p1"].split(" ", 1)[1]) == [["put", 23, ["23", "new"]], ["put", 25, ["25", "c"]]]
+    assert write_buffer.results["applied"] == 3
+
+
+# a put onto a position holding a different event id is refused, and updates and deletes need the record to exist
+def test_apply_write_reports_collisions():
+    peer = DHT_peer.DHT_peer("127.0.0.1", 0, "p0", "127.0.0.1", 0, 0, standalone=False)
+    try:
+        peer.set_placement(11, [1])
+        peer.id, peer.ring_size = 0, 1
+        assert peer.apply_write("put", 5, ["5", "a"]) == "applied"
+        assert peer.apply_write("put", 16, ["16", "b"]) == "collision"
+        assert peer.local_hash_table[5] == ["5", "a"]
+        assert peer.apply_write("update", 16, ["16", "b"]) == "missing"
+        assert peer.apply_write("update", 5, ["5", "c"]) == "applied"
+        assert peer.apply_write("delete", 16, None) == "missing"
+        assert peer.apply_write("delete", 5, None) == "applied"
+        assert peer.apply_write("put", 16, ["16", "b"]) == "applied"
+    finally:
+        peer.m_port_socket.close()
+        peer.p_port_socket.close()
+
+
+# a filter is dropped when its peer announces a newer data version, so the client stops answering "not found" from it
+def test_bloom_version_drops_stale_filter():
+    peer = DHT_peer.DHT_peer("127.0.0.1", 0, "client", "127.0.0.1", 0, 0, standalone=False)
+    try:
+        filters = {name: BloomFilter(64, 0.01) for name in ("p0", "p1")}
+        now = DHT_peer.time.monotonic()
+        peer.bloom_filters = {"p0": (filters["p0"], now, 7), "p1": (filters["p1"], now, 3)}
+        peer.bloom_peers = ["p0", "p1"]
+        peer.bloom_filters_fetched_at = now
+        assert peer.is_definite_miss(42)
+        peer.receive_bloom_version("p0 7") # not newer than the filter
+        assert peer.is_definite_miss(42)
+        peer.receive_bloom_version("p1 4")
+        assert "p1" not in peer.bloom_filters
+        assert not peer.is_definite_miss(42)
+        assert peer.bloom_filters_fetched_at == 0 # the next query fetches the filters again
+    finally:
+        peer.m_port_socket.close()
+        peer.p_port_socket.close()
+
+
+# a page of a range query holds at least one record, even one larger than a store batch, so the querying peer never asks for the same page again
+def test_find_range_page_always_moves_forward(monkeypatch):
+    monkeypatch.setattr(DHT_peer, "STORE_BATCH_BYTES", 100)
+    peer = DHT_peer.DHT_peer("127.0.0.1", 0, "p0", "127.0.0.1", 0, 0, standalone=False)
+    querying = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        querying.bind(("127.0.0.1", 0))
+        querying.settimeout(1)
+        for event_id, size in ((10, 150), (11, 20), (12, 20), (13, 150)):
+            peer.store_local(event_id, [str(event_id), "x" * size])
+
+        def page(lo):
+            peer.find_range_page("range-1 " + str(lo) + " 13", *querying.getsockname())
+            return json.loads(querying.recvfrom(DHT_peer.BUFFER_SIZE)[0].decode('utf-8').split(" ", 3)[3])
+
+        pages = [page(10)]
+        while pages[-1]["more"]:
+            pages.append(page(int(pages[-1]["records"][-1][0]) + 1))
+        assert [[int(event[0]) for event in page["records"]] for page in pages] == [[10], [11, 12], [13]]
+    finally:
+        querying.close()
+        peer.m_port_socket.close()
+        peer.p_port_socket.close()
+
+
+# a resent set_id is acknowledged again without clearing the records stored since, and a different ring clears them
+def test_set_id_is_idempotent():
+    peer = DHT_peer.DHT_peer("127.0.0.1", 0, "p1", "127.0.0.1", 0, 0, standalone=False)
+    leader = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        leader.bind(("127.0.0.1", 0))
+        leader.settimeout(1)
+        ring = json.dumps([["p0", "127.0.0.1", 1], ["p1", "127.0.0.1", 2]])
+        peer.set_id("set_id-1 1 2 " + ring, *leader.getsockname())
+        assert leader.recvfrom(1024)[0] == b"ack set_id-1 p1"
+        peer.store_local(5, ["5", "a"])
+        peer.set_id("set_id-1 1 2 " + ring, *leader.getsockname())
+        assert leader.recvfrom(1024)[0] == b"ack set_id-1 p1"
+        assert peer.local_hash_table == {5: ["5", "a"]}
+        peer.set_id("set_id-2 0 1 " + json.dumps([["p1", "127.0.0.1", 2]]), *leader.getsockname())
+        assert leader.recvfrom(1024)[0] == b"ack set_id-2 p1"
+        assert peer.local_hash_table == {} and peer.id == 0 and peer.ring_size == 1
+    finally:
+        leader.close()
+        peer.m_port_socket.close()
+        peer.p_port_socket.close()